@@ -0,0 +1,5 @@
+"""
+VeilGuard benchmarks
+
+Run from the repository root, e.g.: python -m benchmarks.normalize
+"""
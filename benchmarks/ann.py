@@ -0,0 +1,138 @@
+"""
+Benchmark for veilguard_index.IVFIndex: recall and latency vs exact search
+
+Builds a synthetic threat corpus (clustered random 384-d embeddings, so no
+model is needed), then for each nprobe setting reports recall@1 and
+recall@k against exact ThreatMatrix scoring, and p50/p99 single-query
+latency. Also times the index round-trip through save() / mmap load().
+
+Usage: python -m benchmarks.ann [--patterns 100000] [--queries 500]
+"""
+
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from veilguard_index import IVFIndex
+from veilguard_ml import ThreatMatrix, l2_normalize
+
+DIMENSION = 384
+TOP_K = 10
+NPROBES = [1, 2, 4, 8, 16, 32, 64]
+
+def make_corpus(count, rng, clusters=2000, spread=1.5):
+    """
+    Unit vectors scattered around random cluster centres
+    
+    Jailbreak prompts come in families of near-duplicates, so a clustered
+    corpus is closer to reality (and harder to fake recall on) than
+    uniform noise.
+    """
+    centres = l2_normalize(rng.standard_normal((clusters, DIMENSION)))
+    members = centres[rng.integers(0, clusters, count)]
+    noise = rng.standard_normal((count, DIMENSION)) / np.sqrt(DIMENSION)
+    return l2_normalize(members + spread * noise)
+
+def percentile_ms(samples, q):
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+def time_queries(search, queries):
+    """
+    Run search(query) one query at a time and return per-query seconds
+    """
+    timings = []
+    for query in queries:
+        started = time.perf_counter()
+        search(query[None, :])
+        timings.append(time.perf_counter() - started)
+    return timings
+
+def run(pattern_count=100000, query_count=500, seed=0):
+    """
+    Compare exact and IVF search on one synthetic corpus
+    
+    Returns:
+        dict: Build/load timings plus one row per nprobe (and the exact baseline)
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = make_corpus(pattern_count, rng)
+    patterns = [f"pattern {index}" for index in range(pattern_count)]
+    
+    # Queries: perturbed corpus members (near-duplicate attacks)
+    queries = l2_normalize(
+        embeddings[rng.integers(0, pattern_count, query_count)]
+        + 0.5 * rng.standard_normal((query_count, DIMENSION)) / np.sqrt(DIMENSION)
+    )
+    
+    exact = ThreatMatrix(patterns, embeddings)
+    exact_indices, _ = exact.top_k(queries, TOP_K)
+    exact_timings = time_queries(lambda query: exact.top_k(query, TOP_K), queries)
+    
+    started = time.perf_counter()
+    built = IVFIndex.build(patterns, embeddings)
+    build_seconds = time.perf_counter() - started
+    
+    with tempfile.TemporaryDirectory() as directory:
+        built.save(directory)
+        started = time.perf_counter()
+        index = IVFIndex.load(directory)
+        load_seconds = time.perf_counter() - started
+        
+        rows = [{
+            "method": "exact",
+            "nprobe": None,
+            "recall@1": 1.0,
+            f"recall@{TOP_K}": 1.0,
+            "p50_ms": percentile_ms(exact_timings, 50),
+            "p99_ms": percentile_ms(exact_timings, 99)
+        }]
+        for nprobe in NPROBES:
+            if nprobe > index.n_lists:
+                break
+            indices, _ = index.top_k(queries, TOP_K, nprobe=nprobe)
+            recall_1 = float(np.mean(indices[:, 0] == exact_indices[:, 0]))
+            recall_k = float(np.mean([
+                len(set(found) & set(expected)) / TOP_K
+                for found, expected in zip(indices.tolist(), exact_indices.tolist())
+            ]))
+            timings = time_queries(lambda query: index.top_k(query, TOP_K, nprobe=nprobe), queries)
+            rows.append({
+                "method": "ivf",
+                "nprobe": nprobe,
+                "recall@1": round(recall_1, 3),
+                f"recall@{TOP_K}": round(recall_k, 3),
+                "p50_ms": percentile_ms(timings, 50),
+                "p99_ms": percentile_ms(timings, 99)
+            })
+    
+    return {
+        "patterns": pattern_count,
+        "queries": query_count,
+        "n_lists": index.n_lists,
+        "build_seconds": round(build_seconds, 2),
+        "load_seconds": round(load_seconds, 4),
+        "rows": rows
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VeilGuard ANN index benchmark")
+    parser.add_argument("--patterns", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+    
+    print("=" * 70)
+    print("VeilGuard Benchmark - ANN threat index (IVF) vs exact scoring")
+    print("=" * 70)
+    
+    report = run(args.patterns, args.queries)
+    print(f"[*] {report['patterns']} patterns, {report['n_lists']} lists, "
+          f"built in {report['build_seconds']}s, mmap load in {report['load_seconds']}s")
+    
+    print(f"\n{'method':>7} {'nprobe':>7} {'recall@1':>9} {f'recall@{TOP_K}':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for row in report["rows"]:
+        print(f"{row['method']:>7} {str(row['nprobe'] or '-'):>7} {row['recall@1']:>9} "
+              f"{row[f'recall@{TOP_K}']:>10} {row['p50_ms']:>9} {row['p99_ms']:>9}")
+    print("=" * 70)
@@ -0,0 +1,164 @@
+"""
+Benchmark for length-bucketed batching: padding and batch latency
+
+Batches are drawn from a length mix modelled on /check traffic.
+SecurityCheckRequest inputs run from 1 to 10,000 characters: mostly short
+chat turns, then a tail of prompts with pasted context and a few
+near-limit documents. The same lengths are run three ways through
+VeilGuardML.detect_many:
+
+- unbucketed: one job per batch, forward passes only sorted by length
+- encoder buckets: one job per batch, forward passes never mix buckets
+- bucketer: LengthBucketer splits each batch and runs the buckets as
+  parallel jobs on the inference executor
+
+Every scenario gets its own distinct texts, so the embedding cache never
+answers. Reports p50/p99 batch latency, items/sec and the padding share of
+the token matrix.
+
+Usage: python -m benchmarks.buckets [--batches 40] [--batch-size 64] [--threads 2] [--boundaries 16 32 64 128]
+"""
+
+import argparse
+import asyncio
+import time
+
+import numpy as np
+
+import veilguard_metrics as metrics
+from benchmarks.suite import make_inputs
+from veilguard_batching import InferenceExecutor, LengthBucketer
+
+# (share of requests, min chars, max chars); lengths are log-uniform inside a band
+LENGTH_MIX = [
+    (0.55, 10, 120),      # short chat turns and questions
+    (0.25, 120, 600),     # prompts with a paragraph of context
+    (0.12, 600, 2000),    # pasted emails / snippets
+    (0.06, 2000, 6000),   # documents
+    (0.02, 6000, 10000)   # near the 10,000 character limit
+]
+
+def sample_lengths(count, rng):
+    shares = np.array([share for share, _, _ in LENGTH_MIX])
+    bands = rng.choice(len(LENGTH_MIX), size=count, p=shares / shares.sum())
+    return [
+        int(np.exp(rng.uniform(np.log(LENGTH_MIX[band][1]), np.log(LENGTH_MIX[band][2]))))
+        for band in bands
+    ]
+
+def make_batches(scenario, lengths, batch_size, rng):
+    texts = [make_inputs(1, length, rng, attack_rate=0.1, tag=f"{scenario}-")[0] for length in lengths]
+    return [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+
+async def time_batches(run_batch, batches):
+    """
+    Run each batch once (after an untimed warm-up); returns per-batch seconds and the token totals
+    """
+    await run_batch(batches[0][:8])
+    timings = []
+    tokens = [0, 0]
+    for batch in batches:
+        with metrics.collect_timings() as timings_of_batch:
+            started = time.perf_counter()
+            await run_batch(batch)
+            timings.append(time.perf_counter() - started)
+        real, padded = timings_of_batch.get("_tokens", (0, 0))
+        tokens[0] += real
+        tokens[1] += padded
+    return timings, tokens
+
+def summarize(name, timings, tokens, batch_size):
+    timings = np.asarray(timings)
+    return {
+        "scenario": name,
+        "p50_ms": round(float(np.percentile(timings, 50)) * 1000, 1),
+        "p99_ms": round(float(np.percentile(timings, 99)) * 1000, 1),
+        "items_per_sec": round(batch_size / float(timings.mean()), 1),
+        "padding_ratio": round(1 - tokens[0] / tokens[1], 3) if tokens[1] else None
+    }
+
+async def run(batch_count=40, batch_size=64, threads=2, boundaries=None, seed=0):
+    """
+    Time the three scenarios on the same length samples
+    
+    Returns:
+        dict: Settings, length percentiles and one row per scenario
+    """
+    from veilguard_ml import VeilGuardML
+    
+    rng = np.random.default_rng(seed)
+    lengths = sample_lengths(batch_count * batch_size, rng)
+    
+    detector = VeilGuardML()
+    encoder = detector.model
+    executor = InferenceExecutor(workers=threads)
+    bucketer = LengthBucketer(detector.token_lengths, boundaries=boundaries, min_batch=2)
+    if hasattr(encoder, "length_buckets"):
+        encoder_buckets = bucketer.boundaries
+    else:
+        print("[!] Encoder has no local tokenizer: only the bucketer scenario splits by length")
+        encoder_buckets = None
+    
+    def set_encoder_buckets(buckets):
+        if encoder_buckets is not None:
+            encoder.length_buckets = buckets
+    
+    async def one_job(batch):
+        return await executor.run(detector.detect_many, batch)
+    
+    async def bucketed(batch):
+        return await bucketer.run(executor, detector.detect_many, batch)
+    
+    scenarios = [
+        ("unbucketed", one_job, ()),
+        ("encoder buckets", one_job, encoder_buckets),
+        ("bucketer", bucketed, encoder_buckets)
+    ]
+    rows = []
+    try:
+        for index, (name, run_batch, buckets) in enumerate(scenarios):
+            set_encoder_buckets(buckets)
+            batches = make_batches(index, lengths, batch_size, rng)
+            timings, tokens = await time_batches(run_batch, batches)
+            rows.append(summarize(name, timings, tokens, batch_size))
+    finally:
+        set_encoder_buckets(encoder_buckets)
+        executor.shutdown()
+    
+    token_lengths = detector.token_lengths(make_batches("lengths", lengths, len(lengths), rng)[0])
+    return {
+        "batches": batch_count,
+        "batch_size": batch_size,
+        "threads": threads,
+        "boundaries": list(bucketer.boundaries),
+        "chars_p50_p90_p99": [int(np.percentile(lengths, q)) for q in (50, 90, 99)],
+        "tokens_p50_p90_p99": [int(np.percentile(token_lengths, q)) for q in (50, 90, 99)],
+        "bucket_items": bucketer.stats()["bucket_items"],
+        "rows": rows
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VeilGuard length bucketing benchmark")
+    parser.add_argument("--batches", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=2, help="Inference executor threads")
+    parser.add_argument("--boundaries", type=int, nargs="+", help="Token-length bucket boundaries")
+    args = parser.parse_args()
+    
+    print("=" * 70)
+    print("VeilGuard Benchmark - length-bucketed batching")
+    print("=" * 70)
+    
+    report = asyncio.run(run(args.batches, args.batch_size, args.threads, args.boundaries))
+    print(f"[*] {report['batches']} batches of {report['batch_size']}, {report['threads']} inference thread(s), "
+          f"buckets {report['boundaries']}")
+    print(f"[*] Input chars p50/p90/p99: {report['chars_p50_p90_p99']}, "
+          f"tokens: {report['tokens_p50_p90_p99']}")
+    print(f"[*] Items per bucket: {report['bucket_items']}")
+    
+    print(f"\n{'scenario':>16} {'p50 ms':>9} {'p99 ms':>9} {'items/s':>9} {'padding':>8}")
+    for row in report["rows"]:
+        print(f"{row['scenario']:>16} {row['p50_ms']:>9} {row['p99_ms']:>9} "
+              f"{row['items_per_sec']:>9} {row['padding_ratio']:>8}")
+    print("=" * 70)
@@ -0,0 +1,97 @@
+"""
+Micro-benchmark for veilguard.normalize_text
+
+Compares the table-driven normalizer against the original chained
+str.replace/regex version, checks both give identical output, and reports
+throughput for inputs from 10 to 10,000 characters (SecurityCheckRequest.max_length).
+
+Usage: python -m benchmarks.normalize
+"""
+
+import random
+import re
+import timeit
+
+from veilguard import normalize_text
+
+LENGTHS = [10, 100, 1000, 10000]
+
+# Plain text, leetspeak, symbols and odd whitespace (typical traffic)
+ASCII_ALPHABET = (
+    "abcdefghijklmnopqrstuvwxyz" * 3
+    + "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    + "0123456789@$!"
+    + "      \t\n.,;:'\"?()[]{}<>|\\/-_*&%#"
+)
+
+# Same plus non-ASCII letters and whitespace (takes the slower translate path)
+UNICODE_ALPHABET = ASCII_ALPHABET + "éüßçñİΣσK  "
+
+PROFILES = {"ascii": ASCII_ALPHABET, "unicode": UNICODE_ALPHABET}
+
+def legacy_normalize_text(text):
+    """
+    The original implementation, kept here as the reference output
+    """
+    text = text.lower()
+    leetspeak_map = {
+        '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's',
+        '7': 't', '8': 'b', '@': 'a', '$': 's', '!': 'i'
+    }
+    for leet, normal in leetspeak_map.items():
+        text = text.replace(leet, normal)
+    text = re.sub(r'[^a-z0-9\s]', '', text)
+    text = ' '.join(text.split())
+    return text
+
+def make_input(length, rng, alphabet=UNICODE_ALPHABET):
+    return ''.join(rng.choice(alphabet) for _ in range(length))
+
+def check_equivalence(samples=2000, seed=0):
+    """
+    Assert the new normalizer matches the legacy one on random inputs
+    """
+    rng = random.Random(seed)
+    for _ in range(samples):
+        text = make_input(rng.randint(0, 300), rng)
+        expected = legacy_normalize_text(text)
+        got = normalize_text(text)
+        assert got == expected, f"Mismatch for {text!r}: {got!r} != {expected!r}"
+    return samples
+
+def run(repeat=5):
+    """
+    Time both normalizers for each input profile and length
+    
+    Returns:
+        list: One dict per (profile, length) with per-call microseconds and MB/s
+    """
+    rng = random.Random(42)
+    results = []
+    for profile, alphabet in PROFILES.items():
+        for length in LENGTHS:
+            text = make_input(length, rng, alphabet)
+            number = max(10, 200000 // length)
+            row = {"profile": profile, "length": length}
+            for name, func in (("legacy", legacy_normalize_text), ("table", normalize_text)):
+                best = min(timeit.repeat(lambda: func(text), number=number, repeat=repeat)) / number
+                row[f"{name}_us"] = round(best * 1e6, 2)
+                row[f"{name}_mb_s"] = round(length / best / 1e6, 1)
+            row["speedup"] = round(row["legacy_us"] / row["table_us"], 2)
+            results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("VeilGuard Benchmark - normalize_text")
+    print("=" * 70)
+    
+    checked = check_equivalence()
+    print(f"[+] Output identical to legacy normalizer on {checked} random inputs")
+    
+    print(f"\n{'profile':>8} {'length':>8} {'legacy us':>12} {'table us':>12} {'table MB/s':>12} {'speedup':>9}")
+    for row in run():
+        print(f"{row['profile']:>8} {row['length']:>8} {row['legacy_us']:>12} {row['table_us']:>12} "
+              f"{row['table_mb_s']:>12} {row['speedup']:>8}x")
+    print("=" * 70)
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark for veilguard_ml.ThreatMatrix scoring
+
+Compares the original per-request cos_sim() + argmax (renormalizes the
+whole pattern matrix every call) against the pre-normalized ThreatMatrix
+top-k, for threat corpora from 30 to 50,000 patterns. Uses random
+384-dimensional embeddings (MiniLM size), so no model is needed.
+
+Usage: python -m benchmarks.threat_matrix
+"""
+
+import timeit
+
+import numpy as np
+
+from veilguard_ml import ThreatMatrix, cos_sim
+
+CORPUS_SIZES = [30, 1000, 10000, 50000]
+BATCH_SIZES = [1, 32]
+DIMENSION = 384
+TOP_K = 3
+
+def legacy_best_match(queries, embeddings):
+    """
+    The original scoring: cos_sim against the raw embeddings, then argmax
+    """
+    similarities = cos_sim(queries, embeddings)
+    max_indices = similarities.argmax(axis=1)
+    return max_indices, similarities[np.arange(len(max_indices)), max_indices]
+
+def run(repeat=5):
+    """
+    Time legacy vs ThreatMatrix (float32 and float16) per corpus and batch size
+    
+    Returns:
+        list: One dict per (corpus size, batch size) with per-call microseconds
+    """
+    rng = np.random.default_rng(0)
+    results = []
+    for corpus_size in CORPUS_SIZES:
+        embeddings = rng.standard_normal((corpus_size, DIMENSION)).astype(np.float32)
+        patterns = [f"pattern {index}" for index in range(corpus_size)]
+        matrices = {
+            "float32": ThreatMatrix(patterns, embeddings, "float32"),
+            "float16": ThreatMatrix(patterns, embeddings, "float16")
+        }
+        
+        for batch_size in BATCH_SIZES:
+            queries = rng.standard_normal((batch_size, DIMENSION)).astype(np.float32)
+            
+            # Same best match as the legacy path
+            legacy_indices, _ = legacy_best_match(queries, embeddings)
+            top_indices, _ = matrices["float32"].top_k(queries, TOP_K)
+            assert (top_indices[:, 0] == legacy_indices).all()
+            
+            number = max(3, 200000 // (corpus_size * batch_size))
+            row = {"patterns": corpus_size, "batch": batch_size}
+            timings = {"legacy": lambda: legacy_best_match(queries, embeddings)}
+            for dtype, matrix in matrices.items():
+                timings[dtype] = lambda matrix=matrix: matrix.top_k(queries, TOP_K)
+            for name, func in timings.items():
+                best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+                row[f"{name}_us"] = round(best * 1e6, 1)
+            row["speedup"] = round(row["legacy_us"] / row["float32_us"], 2)
+            results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    print("=" * 70)
+    print("VeilGuard Benchmark - threat matrix scoring")
+    print("=" * 70)
+    
+    print(f"\n{'patterns':>9} {'batch':>6} {'legacy us':>11} {'f32 top-k us':>13} {'f16 top-k us':>13} {'speedup':>9}")
+    for row in run():
+        print(f"{row['patterns']:>9} {row['batch']:>6} {row['legacy_us']:>11} {row['float32_us']:>13} "
+              f"{row['float16_us']:>13} {row['speedup']:>8}x")
+    print("=" * 70)
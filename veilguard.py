@@ -1,5 +1,37 @@
-import re
 import os
+import hashlib
+from collections import deque
+
+# Leetspeak substitutions (applied after lowercasing)
+LEETSPEAK_MAP = {
+    '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's',
+    '7': 't', '8': 'b', '@': 'a', '$': 's', '!': 'i'
+}
+
+class _NormalizeTable(dict):
+    """
+    str.translate table that lowercases, undoes leetspeak and strips symbols
+    
+    Entries are computed the first time a character is seen and memoized,
+    so the table covers any Unicode input without being built up front.
+    Characters are mapped to None (dropped) unless they end up as a-z, 0-9
+    or whitespace - the same set the old regex kept. Dropping via None
+    rather than "" keeps CPython on its fast path for ASCII input.
+    """
+    
+    def __missing__(self, codepoint):
+        kept = []
+        for char in chr(codepoint).lower():
+            char = LEETSPEAK_MAP.get(char, char)
+            if 'a' <= char <= 'z' or '0' <= char <= '9' or char.isspace():
+                kept.append(char)
+        value = ''.join(kept) or None
+        self[codepoint] = value
+        return value
+
+_NORMALIZE_TABLE = _NormalizeTable()
+for _codepoint in range(256):
+    _NORMALIZE_TABLE[_codepoint]
 
 def normalize_text(text):
     """
@@ -10,25 +42,42 @@ def normalize_text(text):
     - Leetspeak (1gn0r3 -> ignore)
     - Extra spaces (i g n o r e -> ignore)
     - Special characters (i!g@n#o$r%e -> ignore)
-    """
-    # Convert to lowercase
-    text = text.lower()
     
-    # Replace leetspeak common substitutions
-    leetspeak_map = {
-        '0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's',
-        '7': 't', '8': 'b', '@': 'a', '$': 's', '!': 'i'
-    }
-    for leet, normal in leetspeak_map.items():
-        text = text.replace(leet, normal)
+    One translate pass does the case folding, leetspeak and symbol removal,
+    then one split/join collapses whitespace.
+    """
+    return ' '.join(text.translate(_NORMALIZE_TABLE).split())
+
+class NormalizedInput:
+    """
+    User input normalized once and shared by every detector
     
-    # Remove all non-alphanumeric characters except spaces
-    text = re.sub(r'[^a-z0-9\s]', '', text)
+    Detectors accept either a raw string or one of these, so the hybrid and
+    smart engines only pay for normalization once per request.
+    """
     
-    # Remove extra spaces
-    text = ' '.join(text.split())
+    __slots__ = ('raw', 'text')
     
-    return text
+    def __init__(self, raw):
+        self.raw = raw
+        self.text = normalize_text(raw)
+
+def normalize_input(user_input):
+    """
+    Wrap raw text in a NormalizedInput (already-normalized input passes through)
+    """
+    if isinstance(user_input, NormalizedInput):
+        return user_input
+    return NormalizedInput(user_input)
+
+def env_flag(name, default=False):
+    """
+    Read a boolean setting from an environment variable ("1", "true", "yes", "on")
+    """
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
 
 def get_danger_patterns():
     """
@@ -145,26 +194,168 @@ def get_danger_patterns():
         "system(",
     ]
 
+class PatternMatcher:
+    """
+    Precompiled multi-pattern matcher (Aho-Corasick automaton)
+    
+    Built once over the normalized danger patterns, then scans normalized
+    input in a single pass. Scan cost depends on the input length, not on
+    how many patterns are loaded, so the pattern list can grow freely.
+    """
+    
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        # Identifies this pattern set (e.g. for cache keys); changes on any edit
+        self.version = hashlib.sha256('\n'.join(self.patterns).encode()).hexdigest()[:16]
+        
+        # Trie of normalized patterns: goto[state][char] -> next state
+        self._goto = [{}]
+        # out[state] -> (pattern index, normalized length) ending at state
+        self._out = [[]]
+        # Patterns that normalize to "" match every input (same as `"" in text`)
+        self._always = []
+        
+        for index, pattern in enumerate(self.patterns):
+            key = normalize_text(pattern)
+            if not key:
+                self._always.append(index)
+                continue
+            state = 0
+            for char in key:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._out.append([])
+                state = next_state
+            self._out[state].append((index, len(key)))
+        
+        # Breadth-first pass to wire up failure links. Each state inherits
+        # the outputs of its failure state so suffix matches are reported too.
+        self._fail = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+    
+    def find_all(self, normalized_text):
+        """
+        Find every pattern occurrence in already-normalized text
+        
+        Returns:
+            list: (pattern, start, end) tuples, offsets into normalized_text
+        """
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        matches = [(patterns[index], 0, 0) for index in self._always]
+        
+        state = 0
+        for position, char in enumerate(normalized_text):
+            next_state = goto[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(char)
+            state = next_state or 0
+            if out[state]:
+                end = position + 1
+                for index, length in out[state]:
+                    matches.append((patterns[index], end - length, end))
+        
+        return matches
+    
+    def match(self, normalized_text):
+        """
+        Return the distinct patterns found, in pattern-list order
+        """
+        found = set(self._always)
+        goto, fail, out = self._goto, self._fail, self._out
+        
+        state = 0
+        for char in normalized_text:
+            next_state = goto[state].get(char)
+            while next_state is None and state:
+                state = fail[state]
+                next_state = goto[state].get(char)
+            state = next_state or 0
+            if out[state]:
+                found.update(index for index, _ in out[state])
+        
+        return [self.patterns[index] for index in sorted(found)]
+
+# (raw VEILGUARD_PATTERNS value, compiled matcher) - rebuilt only when the env var changes
+_matcher_cache = None
+
+# Matcher installed at runtime by set_danger_patterns(); wins over the env var
+_matcher_override = None
+
+def set_danger_patterns(patterns):
+    """
+    Replace the keyword patterns at runtime (hot reload)
+    
+    The new automaton is fully built before it is swapped in with a single
+    assignment, so concurrent detections use either the old or the new
+    pattern set, never a half-built one.
+    
+    Args:
+        patterns (list | None): New patterns, or None to go back to
+                                VEILGUARD_PATTERNS / the defaults
+    
+    Returns:
+        PatternMatcher: The matcher now in use
+    """
+    global _matcher_override
+    
+    if patterns is None:
+        _matcher_override = None
+        return get_pattern_matcher()
+    
+    patterns = [pattern.strip() for pattern in patterns if pattern.strip()]
+    if not patterns:
+        raise ValueError("Keyword pattern list cannot be empty")
+    
+    matcher = PatternMatcher(patterns)
+    _matcher_override = matcher
+    return matcher
+
+def get_pattern_matcher():
+    """
+    Get the compiled matcher for the current danger patterns
+    
+    The automaton is built once and reused until VEILGUARD_PATTERNS changes
+    (or set_danger_patterns() installs a new one).
+    """
+    global _matcher_cache
+    
+    override = _matcher_override
+    if override is not None:
+        return override
+    
+    env_patterns = os.getenv('VEILGUARD_PATTERNS')
+    cached = _matcher_cache
+    if cached is None or cached[0] != env_patterns:
+        cached = (env_patterns, PatternMatcher(get_danger_patterns()))
+        _matcher_cache = cached
+    
+    return cached[1]
+
 def detect_jailbreak(user_input):
     """
     VeilGuard Core v0.3 - Enhanced Edition
     Detects prompt injection attempts with normalization
     """
     
-    # Normalize input to catch obfuscation
-    normalized_text = normalize_text(user_input)
+    # Normalize input to catch obfuscation (reuses the caller's normalization if given)
+    normalized_text = normalize_input(user_input).text
     
-    # Get patterns (from env var in production, defaults in dev)
-    danger_patterns = get_danger_patterns()
-    
-    # Check for dangerous patterns in normalized text
-    threats_found = []
-    for pattern in danger_patterns:
-        # Normalize the pattern too
-        normalized_pattern = normalize_text(pattern)
-        
-        if normalized_pattern in normalized_text:
-            threats_found.append(pattern)
+    # Scan for all dangerous patterns in one pass
+    # (patterns come from env var in production, defaults in dev)
+    threats_found = get_pattern_matcher().match(normalized_text)
     
     # Additional heuristic checks
     suspicion_score = 0
@@ -205,6 +396,13 @@ def detect_jailbreak(user_input):
 
 # Test it!
 if __name__ == "__main__":
+    import sys
+    
+    # python -m veilguard scan ...: offline bulk scanner (veilguard_scan.py)
+    if sys.argv[1:2] == ["scan"]:
+        from veilguard_scan import main
+        sys.exit(main(sys.argv[2:]))
+    
     print("=" * 70)
     print("VeilGuard AI - Enhanced Keyword Detection v0.3")
     print("=" * 70)
@@ -0,0 +1,372 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import veilguard_metrics as metrics
+from veilguard_encoders import bucket_of, length_buckets
+
+# Defaults for the /check micro-batcher (overridable via env vars)
+DEFAULT_MAX_BATCH_SIZE = 32
+DEFAULT_MAX_WAIT_MS = 5.0
+
+# Defaults for the inference executor (overridable via env vars)
+DEFAULT_INFERENCE_THREADS = 1
+DEFAULT_MAX_QUEUE_DEPTH = 256
+
+# Batches smaller than this aren't split by length (VEILGUARD_BUCKET_MIN_BATCH)
+DEFAULT_BUCKET_MIN_BATCH = 8
+
+class QueueFullError(Exception):
+    """
+    Raised when the inference pipeline is saturated and won't accept more work
+    
+    The API turns this into 503 + Retry-After instead of letting requests
+    pile up and tail latency collapse.
+    """
+
+class InferenceExecutor:
+    """
+    VeilGuard Inference Executor
+    Dedicated, bounded thread pool for CPU-bound encoder work
+    
+    Keeps model inference off the event loop and off the shared anyio
+    threadpool that serves I/O. At most `workers` jobs run at once and at
+    most `max_queue_depth` jobs may be pending (running + waiting); beyond
+    that run() raises QueueFullError immediately.
+    
+    Counters are only touched from the event loop thread, so no lock needed.
+    """
+    
+    def __init__(self, workers=None, max_queue_depth=None):
+        self.workers = max(1, int(
+            workers or os.getenv('VEILGUARD_INFERENCE_THREADS') or DEFAULT_INFERENCE_THREADS
+        ))
+        self.max_queue_depth = max(1, int(
+            max_queue_depth or os.getenv('VEILGUARD_MAX_QUEUE_DEPTH') or DEFAULT_MAX_QUEUE_DEPTH
+        ))
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="veilguard-inference"
+        )
+        
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+    
+    async def run(self, func, *args, check_capacity=True):
+        """
+        Run func(*args) on an inference thread and await the result
+        
+        Args:
+            check_capacity (bool): Reject with QueueFullError when saturated.
+                                   The micro-batcher passes False because it
+                                   already admitted (and bounded) its items.
+        """
+        if check_capacity and self.pending >= self.max_queue_depth:
+            self.rejected += 1
+            raise QueueFullError(
+                f"Inference queue is full ({self.pending} pending). Please retry shortly."
+            )
+        
+        self.pending += 1
+        try:
+            # Run in a copy of the caller's context, so per-request stage
+            # timings (veilguard_metrics) are recorded against the request
+            context = contextvars.copy_context()
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(context.run, func, *args)
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
+    
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected
+        }
+
+class LengthBucketer:
+    """
+    VeilGuard Length Bucketer
+    Splits a batch by token length and runs the buckets side by side
+    
+    An encoder batch is padded to its longest input, so one 10,000
+    character prompt makes every short prompt batched with it cost a full
+    token window. run() measures each item's token length (length_fn,
+    e.g. VeilGuardML.token_lengths), groups the items into the buckets
+    between `boundaries`, submits one batch_fn job per bucket to the
+    inference executor (with several inference threads the buckets run at
+    the same time) and returns the results in input order.
+    
+    Batches under min_batch items, or whose items all fall into one
+    bucket, run as a single job, and so does everything on a one-thread
+    executor: there the buckets couldn't overlap, and the encoder already
+    keeps buckets apart inside one call (veilguard_encoders.length_buckets).
+    batch_fn must take a list and return a list in the same order, whatever
+    subset of the batch it gets.
+    
+    Settings (explicit args win): VEILGUARD_LENGTH_BUCKETS (16,32,64,128
+    tokens, 0 = don't split), VEILGUARD_BUCKET_MIN_BATCH (8).
+    
+    Counters are only touched from the event loop thread, so no lock needed.
+    """
+    
+    def __init__(self, length_fn, boundaries=None, min_batch=None):
+        self.length_fn = length_fn
+        self.boundaries = length_buckets(boundaries)
+        self.min_batch = max(2, int(
+            min_batch or os.getenv('VEILGUARD_BUCKET_MIN_BATCH') or DEFAULT_BUCKET_MIN_BATCH
+        ))
+        
+        self.batches = 0
+        self.split_batches = 0
+        self.bucket_items = [0] * (len(self.boundaries) + 1)
+    
+    async def run(self, executor, batch_fn, items, texts=None, check_capacity=True):
+        """
+        Run batch_fn over items on the inference executor, one job per length bucket
+        
+        Args:
+            executor (InferenceExecutor): Runs the length pass and the bucket jobs
+            texts (list): Text of each item for length_fn (default: the items
+                          themselves); None counts as length 0
+            check_capacity (bool): As for InferenceExecutor.run(). Only the
+                                   first job is checked; the bucket jobs
+                                   belong to a batch that was already admitted.
+        
+        Returns:
+            list: batch_fn results for all items, in input order
+        """
+        items = list(items)
+        self.batches += 1
+        if not self.boundaries or len(items) < self.min_batch or executor.workers < 2:
+            return await executor.run(batch_fn, items, check_capacity=check_capacity)
+        
+        lengths = await executor.run(
+            self._lengths, items if texts is None else list(texts), check_capacity=check_capacity
+        )
+        buckets = {}
+        for index, length in enumerate(lengths):
+            buckets.setdefault(bucket_of(length, self.boundaries), []).append(index)
+        for bucket, indices in buckets.items():
+            self.bucket_items[bucket] += len(indices)
+        if len(buckets) == 1:
+            return await executor.run(batch_fn, items, check_capacity=False)
+        
+        self.split_batches += 1
+        groups = list(buckets.values())
+        group_results = await asyncio.gather(*(
+            executor.run(batch_fn, [items[index] for index in indices], check_capacity=False)
+            for indices in groups
+        ))
+        
+        # Put every bucket's results back at their items' positions
+        results = [None] * len(items)
+        for indices, partial in zip(groups, group_results):
+            for index, result in zip(indices, partial):
+                results[index] = result
+        return results
+    
+    def stats(self):
+        labels = [f"<={boundary}" for boundary in self.boundaries]
+        labels.append(f">{self.boundaries[-1]}" if self.boundaries else "all")
+        return {
+            "boundaries": list(self.boundaries),
+            "min_batch": self.min_batch,
+            "batches": self.batches,
+            "split_batches": self.split_batches,
+            "bucket_items": dict(zip(labels, self.bucket_items))
+        }
+    
+    def _lengths(self, texts):
+        measured = [text for text in texts if text is not None]
+        lengths = iter(self.length_fn(measured) if measured else [])
+        return [0 if text is None else next(lengths) for text in texts]
+
+class MicroBatcher:
+    """
+    VeilGuard Micro-Batcher
+    Coalesces concurrent single-item calls into one batched call
+    
+    Callers await submit(item). A background task collects items until
+    either max_batch_size items are waiting or max_wait_ms has passed since
+    the first one arrived, runs batch_fn(items) once on the inference
+    executor, and hands each caller its own result. While one batch runs,
+    the next one is already being collected; up to executor.workers batches
+    run at the same time.
+    
+    At most max_queue_depth items may be waiting or in flight; submit()
+    raises QueueFullError beyond that.
+    
+    batch_fn must take a list and return a list of results in the same order
+    (e.g. VeilGuardML.detect_many).
+    
+    With a bucketer (LengthBucketer), each batch is split by token length
+    and the buckets run as separate executor jobs.
+    
+    Stage timings recorded while a batch runs (encode, similarity, token
+    counts) are added to the timings of every request in that batch.
+    """
+    
+    def __init__(self, batch_fn, max_batch_size=None, max_wait_ms=None, executor=None,
+                 max_queue_depth=None, bucketer=None):
+        self.batch_fn = batch_fn
+        self.bucketer = bucketer
+        self.max_batch_size = max(1, int(
+            max_batch_size or os.getenv('VEILGUARD_BATCH_MAX_SIZE') or DEFAULT_MAX_BATCH_SIZE
+        ))
+        self.max_wait = float(
+            max_wait_ms if max_wait_ms is not None
+            else os.getenv('VEILGUARD_BATCH_WAIT_MS') or DEFAULT_MAX_WAIT_MS
+        ) / 1000
+        self.executor = executor if executor is not None else InferenceExecutor()
+        self.max_queue_depth = max(1, int(
+            max_queue_depth or os.getenv('VEILGUARD_MAX_QUEUE_DEPTH') or DEFAULT_MAX_QUEUE_DEPTH
+        ))
+        
+        # Items queued or in a running batch (only touched on the event loop)
+        self.queue_depth = 0
+        self.rejected = 0
+        
+        # Created lazily so they bind to the running event loop
+        self._loop = None
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._batches = set()
+    
+    async def submit(self, item):
+        """
+        Queue one item and wait for its result from the next batch
+        
+        Raises:
+            QueueFullError: If max_queue_depth items are already pending
+        """
+        if self.queue_depth >= self.max_queue_depth:
+            self.rejected += 1
+            raise QueueFullError(
+                f"Inference queue is full ({self.queue_depth} pending). Please retry shortly."
+            )
+        
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.executor.workers)
+            self._worker = loop.create_task(self._run())
+        
+        future = loop.create_future()
+        self._queue.put_nowait((item, future, metrics.current_timings()))
+        self.queue_depth += 1
+        try:
+            return await future
+        finally:
+            self.queue_depth -= 1
+    
+    async def close(self):
+        """
+        Stop the background tasks (pending callers get CancelledError)
+        """
+        tasks = list(self._batches)
+        if self._worker is not None:
+            tasks.append(self._worker)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+        
+        while self._queue is not None and not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            future.cancel()
+    
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "rejected": self.rejected
+        }
+    
+    async def _collect(self):
+        """
+        Wait for the first item, then gather more until the batch is full or the window closes
+        """
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without waiting
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free executor slot before collecting, so items keep
+            # joining the next batch while all workers are busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+            
+            # Skip callers that gave up (e.g. client disconnected) while queued
+            batch = [entry for entry in batch if not entry[1].done()]
+            if not batch:
+                self._slots.release()
+                continue
+            
+            task = loop.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+    
+    async def _run_batch(self, batch):
+        try:
+            items = [item for item, _, _ in batch]
+            with metrics.collect_timings() as batch_timings:
+                if self.bucketer is not None:
+                    results = await self.bucketer.run(self.executor, self.batch_fn, items, check_capacity=False)
+                else:
+                    results = await self.executor.run(self.batch_fn, items, check_capacity=False)
+        except asyncio.CancelledError:
+            # Shutting down mid-batch: don't leave these callers hanging
+            for _, future, _ in batch:
+                future.cancel()
+            raise
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+        
+        for (_, future, timings), result in zip(batch, results):
+            metrics.merge_timings(batch_timings, timings)
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,660 @@
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Defaults for the verdict cache (overridable via env vars)
+DEFAULT_CACHE_ENTRIES = 10000
+DEFAULT_CACHE_MB = 64
+DEFAULT_CACHE_TTL_SECONDS = 300
+
+def estimate_size(value):
+    """
+    Rough deep size in bytes of a JSON-like value (dicts, lists, strings, numbers)
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            size += estimate_size(key) + estimate_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += estimate_size(item)
+    return size
+
+class VerdictCache:
+    """
+    VeilGuard Verdict Cache
+    Bounded LRU + TTL cache of detection results
+    
+    Keys are SHA-256 hashes of (detector config version, raw input), so a
+    10k-char input costs 64 bytes of key and a pattern reload (new config
+    version) can never serve stale verdicts. The key is never built from
+    the normalized text: normalization drops every non-Latin character,
+    while the ML layer scores the raw text. Entries are
+    memory-accounted and the cache evicts least-recently-used entries once
+    it exceeds either max_entries or max_mb.
+    
+    Values are deep-copied on the way in and out, so callers can freely
+    add fields (e.g. "source") to what they get back.
+    """
+    
+    def __init__(self, max_entries=None, max_mb=None, ttl_seconds=None):
+        self.max_entries = int(
+            max_entries if max_entries is not None
+            else os.getenv('VEILGUARD_CACHE_SIZE') or DEFAULT_CACHE_ENTRIES
+        )
+        self.max_bytes = int(float(
+            max_mb if max_mb is not None
+            else os.getenv('VEILGUARD_CACHE_MB') or DEFAULT_CACHE_MB
+        ) * 1024 * 1024)
+        self.ttl = float(
+            ttl_seconds if ttl_seconds is not None
+            else os.getenv('VEILGUARD_CACHE_TTL') or DEFAULT_CACHE_TTL_SECONDS
+        )
+        
+        # key -> (expires_at, size_bytes, value), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+    
+    @staticmethod
+    def make_key(config_version, text):
+        """
+        Cache key for a raw input under a given detector config
+        """
+        digest = hashlib.sha256()
+        digest.update(config_version.encode())
+        digest.update(b'\0')
+        digest.update(text.encode())
+        return digest.hexdigest()
+    
+    def get(self, key):
+        """
+        Return a copy of the cached value, or None on a miss/expired entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            expires_at, size, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.bytes_used -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(key)
+            self.hits += 1
+        
+        return copy.deepcopy(value)
+    
+    def put(self, key, value):
+        """
+        Store a copy of value, evicting LRU entries to stay within limits
+        """
+        if not self.enabled:
+            return
+        
+        value = copy.deepcopy(value)
+        size = estimate_size(key) + estimate_size(value)
+        if size > self.max_bytes:
+            return
+        
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes_used -= old[1]
+            
+            self._entries[key] = (time.monotonic() + self.ttl, size, value)
+            self.bytes_used += size
+            
+            while len(self._entries) > self.max_entries or self.bytes_used > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.bytes_used -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+    
+    def stats(self):
+        """
+        Counters and current usage, for /health and monitoring
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+# Defaults for the embedding cache (overridable via env vars)
+DEFAULT_EMBEDDING_CACHE_MB = 32
+DEFAULT_EMBEDDING_CACHE_DTYPE = "float16"
+
+class EmbeddingCache:
+    """
+    VeilGuard Embedding Cache
+    LRU cache of input embeddings with a memory budget
+    
+    Keyed by a hash of the raw text the encoder sees. Not the normalized
+    text: normalization drops every non-Latin character, so different
+    inputs would share one embedding. Vectors are stored compressed:
+    - float16: 2 bytes/dim, scores change by ~1e-3 at most
+    - int8: 1 byte/dim plus one float32 scale per vector (symmetric
+      per-vector quantization), scores change by ~1e-2 at most
+    
+    get() always returns float32 vectors.
+    """
+    
+    def __init__(self, max_mb=None, dtype=None):
+        self.max_bytes = int(float(
+            max_mb if max_mb is not None
+            else os.getenv('VEILGUARD_EMBEDDING_CACHE_MB') or DEFAULT_EMBEDDING_CACHE_MB
+        ) * 1024 * 1024)
+        self.dtype = dtype or os.getenv('VEILGUARD_EMBEDDING_CACHE_DTYPE') or DEFAULT_EMBEDDING_CACHE_DTYPE
+        if self.dtype not in ("float16", "int8"):
+            raise ValueError(f"Unsupported embedding cache dtype: {self.dtype} (use float16 or int8)")
+        
+        # key -> (size_bytes, stored vector, scale), oldest first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes_used = 0
+        
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+    
+    @staticmethod
+    def make_key(text):
+        return hashlib.blake2b(text.encode(), digest_size=16).digest()
+    
+    def _pack(self, vector):
+        import numpy as np
+        
+        if self.dtype == "float16":
+            return vector.astype(np.float16), 1.0
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype(np.int8), scale
+    
+    def get(self, key):
+        """
+        Return the cached embedding as float32, or None on a miss
+        """
+        import numpy as np
+        
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        
+        _, stored, scale = entry
+        return stored.astype(np.float32) * np.float32(scale)
+    
+    def put(self, key, vector):
+        """
+        Store one embedding, evicting LRU entries to stay within the budget
+        """
+        if not self.enabled:
+            return
+        
+        stored, scale = self._pack(vector)
+        # Vector bytes + key + per-entry bookkeeping
+        size = stored.nbytes + sys.getsizeof(key) + 200
+        
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes_used -= old[0]
+            
+            self._entries[key] = (size, stored, scale)
+            self.bytes_used += size
+            
+            while self.bytes_used > self.max_bytes and self._entries:
+                _, (evicted_size, _, _) = self._entries.popitem(last=False)
+                self.bytes_used -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes_used = 0
+    
+    def stats(self):
+        """
+        Counters and current usage, for /health and monitoring
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "dtype": self.dtype,
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions
+            }
+
+# Defaults for the persistent LLM verdict store (overridable via env vars)
+DEFAULT_LLM_STORE_FILE = "llm_verdicts.sqlite3"
+DEFAULT_LLM_STORE_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_LLM_STORE_MB = 256
+DEFAULT_LLM_STORE_MEMORY_ENTRIES = 5000
+
+# Hit counts are written back in batches by a background thread, after
+# this many hits or seconds
+HIT_FLUSH_COUNT = 256
+HIT_FLUSH_SECONDS = 5.0
+
+# Expired entries are purged and the size cap enforced every N writes
+PRUNE_EVERY_WRITES = 256
+
+LLM_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_verdicts (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    prompt_version TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    last_hit_at REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS llm_verdicts_hot ON llm_verdicts (model, prompt_version, hits);
+CREATE INDEX IF NOT EXISTS llm_verdicts_cold ON llm_verdicts (hits, last_hit_at);
+CREATE INDEX IF NOT EXISTS llm_verdicts_expiry ON llm_verdicts (expires_at);
+"""
+
+class LLMVerdictStore:
+    """
+    VeilGuard LLM Verdict Store
+    Persistent cache of LLM verdicts, shared by all workers and restarts
+    
+    An LLM verdict costs hundreds of milliseconds and real money, and is
+    deterministic (temperature 0) for a given model and prompt. So it's
+    kept on disk in SQLite (WAL mode: readers never block, one writer at a
+    time, safe across the worker processes of one host), keyed by a hash
+    of (model, prompt version, raw input).
+    
+    - A bounded in-memory LRU sits in front of the file. warmup() fills it
+      at boot with the most-hit verdicts for the current model/prompt. It
+      has its own lock, never held during file I/O, so get(key, disk=False)
+      is safe to call from the event loop.
+    - Entries expire after ttl_seconds (wall clock, so TTLs survive restarts).
+    - Hit counts are batched in memory and written back by a background
+      thread.
+    - Every PRUNE_EVERY_WRITES writes, expired rows are purged and the
+      least-hit rows are evicted while the stored verdicts exceed max_mb.
+      The file itself doesn't shrink; freed pages are reused.
+    - Entry and byte totals are counted exactly at each prune (and at
+      warmup) and kept as running totals in between, so stats() never
+      scans the table. Other processes' writes show up at the next prune.
+    
+    SQLite errors never fail a detection: a broken store acts as a miss.
+    """
+    
+    def __init__(self, path, ttl_seconds=None, max_mb=None, memory_entries=None):
+        self.path = path
+        self.ttl = float(
+            ttl_seconds if ttl_seconds is not None
+            else os.getenv('VEILGUARD_LLM_STORE_TTL') or DEFAULT_LLM_STORE_TTL_SECONDS
+        )
+        self.max_bytes = int(float(
+            max_mb if max_mb is not None
+            else os.getenv('VEILGUARD_LLM_STORE_MB') or DEFAULT_LLM_STORE_MB
+        ) * 1024 * 1024)
+        self.memory_entries = int(
+            memory_entries if memory_entries is not None
+            else os.getenv('VEILGUARD_LLM_STORE_MEMORY') or DEFAULT_LLM_STORE_MEMORY_ENTRIES
+        )
+        
+        # One connection per process (opened lazily, reopened after fork);
+        # _lock covers it and all file I/O
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+        
+        # Memory tier, pending hit counts and counters; _memory_lock is never
+        # held while waiting on the file
+        self._memory_lock = threading.Lock()
+        # key -> (expires_at, verdict), oldest first
+        self._memory = OrderedDict()
+        # key -> (hits not yet written, last hit time)
+        self._pending_hits = {}
+        self._pending_count = 0
+        self._writes_since_prune = 0
+        
+        # Background hit-count writer (started lazily, once per process)
+        self._flush_wanted = threading.Event()
+        self._flusher_pid = None
+        self._closed = False
+        
+        # Counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.errors = 0
+        self.warmed = 0
+        # Usage as of the last prune plus this process's writes since (None until measured)
+        self.entries = None
+        self.bytes_used = None
+    
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+    
+    @staticmethod
+    def make_key(model, prompt_version, text):
+        """
+        Store key for a raw input under a given model and prompt version
+        """
+        digest = hashlib.sha256()
+        for part in (model, prompt_version, text):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+    
+    def get(self, key, disk=True):
+        """
+        Return the stored verdict (a fresh copy), or None on a miss/expired entry
+        
+        Args:
+            disk (bool): With False, only the in-memory tier is checked and a
+                         miss isn't counted (for a non-blocking first look
+                         from the event loop)
+        """
+        now = time.time()
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    self._count_hit(key, now)
+                else:
+                    del self._memory[key]
+                    entry = None
+        if entry is not None:
+            # Stored verdicts are never modified in place, so copy outside the lock
+            return copy.deepcopy(entry[1])
+        if not disk:
+            return None
+        
+        with self._lock:
+            try:
+                row = self._connection().execute(
+                    "SELECT verdict, expires_at FROM llm_verdicts WHERE key = ?", (key,)
+                ).fetchone()
+            except (sqlite3.Error, OSError) as e:
+                self._report_error("read", e)
+                row = None
+        
+        if row is None or row[1] <= now:
+            with self._memory_lock:
+                if row is not None:
+                    self.expirations += 1
+                self.misses += 1
+            return None
+        
+        verdict = json.loads(row[0])
+        with self._memory_lock:
+            self._remember(key, row[1], verdict)
+            self.disk_hits += 1
+            self._count_hit(key, now)
+        return copy.deepcopy(verdict)
+    
+    def put(self, key, model, prompt_version, verdict):
+        """
+        Store a verdict (replacing any older one under the same key)
+        """
+        if not self.enabled:
+            return
+        
+        payload = json.dumps(verdict)
+        size = len(key) + len(payload)
+        now = time.time()
+        with self._memory_lock:
+            self._remember(key, now + self.ttl, copy.deepcopy(verdict))
+        with self._lock:
+            try:
+                self._connection().execute(
+                    "INSERT INTO llm_verdicts "
+                    "(key, model, prompt_version, verdict, size, created_at, expires_at, last_hit_at, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0) "
+                    "ON CONFLICT(key) DO UPDATE SET verdict = excluded.verdict, size = excluded.size, "
+                    "created_at = excluded.created_at, expires_at = excluded.expires_at",
+                    (key, model, prompt_version, payload, size, now, now + self.ttl, now)
+                )
+                with self._memory_lock:
+                    self.writes += 1
+                    # A replaced row is counted twice until the next prune
+                    if self.entries is not None:
+                        self.entries += 1
+                        self.bytes_used += size
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= PRUNE_EVERY_WRITES:
+                    self._prune()
+            except (sqlite3.Error, OSError) as e:
+                self._report_error("write", e)
+    
+    def warmup(self, model, prompt_version, limit=None):
+        """
+        Preload the most-hit live verdicts for this model/prompt into memory
+        
+        Returns:
+            int: Number of verdicts loaded
+        """
+        limit = self.memory_entries if limit is None else min(limit, self.memory_entries)
+        
+        with self._lock:
+            try:
+                self._prune()
+                if limit <= 0:
+                    return 0
+                rows = self._connection().execute(
+                    "SELECT key, verdict, expires_at FROM llm_verdicts "
+                    "WHERE model = ? AND prompt_version = ? AND expires_at > ? "
+                    "ORDER BY hits DESC LIMIT ?",
+                    (model, prompt_version, time.time(), limit)
+                ).fetchall()
+            except (sqlite3.Error, OSError) as e:
+                self._report_error("warmup", e)
+                return 0
+        
+        # Coldest first, so the hottest end up most recently used
+        with self._memory_lock:
+            for key, payload, expires_at in reversed(rows):
+                self._remember(key, expires_at, json.loads(payload))
+            self.warmed += len(rows)
+        return len(rows)
+    
+    def flush(self):
+        """
+        Write pending hit counts back to the file
+        """
+        with self._memory_lock:
+            pending = self._pending_hits
+            self._pending_hits = {}
+            self._pending_count = 0
+        if not pending:
+            return
+        with self._lock:
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.executemany(
+                        "UPDATE llm_verdicts SET hits = hits + ?, last_hit_at = ? WHERE key = ?",
+                        [(hits, last_hit_at, key) for key, (hits, last_hit_at) in pending.items()]
+                    )
+            except (sqlite3.Error, OSError) as e:
+                self._report_error("hit count", e)
+    
+    def close(self):
+        self._closed = True
+        self._flush_wanted.set()
+        self.flush()
+        with self._lock:
+            if self._conn is not None and self._pid == os.getpid():
+                self._conn.close()
+            self._conn = None
+    
+    def stats(self):
+        """
+        Counters and current usage, for /health and monitoring (no file I/O)
+        """
+        with self._memory_lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "path": self.path,
+                "entries": self.entries,
+                "bytes_used": self.bytes_used,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "memory_entries": len(self._memory),
+                "max_memory_entries": self.memory_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "warmed": self.warmed,
+                "errors": self.errors
+            }
+    
+    def _connection(self):
+        """
+        This process's connection; caller holds the lock
+        """
+        if self._conn is None or self._pid != os.getpid():
+            # A forked child must not reuse its parent's connection (or its unflushed hits)
+            with self._memory_lock:
+                self._pending_hits = {}
+                self._pending_count = 0
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(LLM_STORE_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+    
+    def _remember(self, key, expires_at, verdict):
+        """
+        Add to the memory tier; caller holds _memory_lock
+        """
+        if self.memory_entries <= 0:
+            return
+        self._memory[key] = (expires_at, verdict)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+    
+    def _count_hit(self, key, now):
+        """
+        Queue a hit count for the background writer; caller holds _memory_lock
+        """
+        hits, _ = self._pending_hits.get(key, (0, now))
+        self._pending_hits[key] = (hits + 1, now)
+        self._pending_count += 1
+        if self._flusher_pid != os.getpid() and not self._closed:
+            # First hit in this process (or after a fork, which drops threads)
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name="veilguard-llm-store", daemon=True).start()
+        if self._pending_count >= HIT_FLUSH_COUNT:
+            self._flush_wanted.set()
+    
+    def _flush_loop(self):
+        """
+        Background writer: flush hit counts every HIT_FLUSH_SECONDS or HIT_FLUSH_COUNT hits
+        """
+        pid = os.getpid()
+        while not self._closed and self._flusher_pid == pid:
+            self._flush_wanted.wait(HIT_FLUSH_SECONDS)
+            self._flush_wanted.clear()
+            if not self._closed:
+                self.flush()
+    
+    def _prune(self):
+        """
+        Purge expired rows, then evict least-hit rows down to 90% of max_bytes
+        """
+        self._writes_since_prune = 0
+        conn = self._connection()
+        expired = conn.execute(
+            "DELETE FROM llm_verdicts WHERE expires_at <= ?", (time.time(),)
+        ).rowcount
+        with self._memory_lock:
+            self.expirations += expired
+        
+        entries, bytes_used = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_verdicts"
+        ).fetchone()
+        if bytes_used > self.max_bytes and entries:
+            # Rows are similar in size, so evict the matching fraction of them
+            excess = bytes_used - int(self.max_bytes * 0.9)
+            count = max(1, -(-entries * excess // bytes_used))
+            evicted = conn.execute(
+                "DELETE FROM llm_verdicts WHERE key IN "
+                "(SELECT key FROM llm_verdicts ORDER BY hits, last_hit_at LIMIT ?)", (count,)
+            ).rowcount
+            self.evictions += evicted
+            bytes_used -= bytes_used * evicted // entries
+            entries -= evicted
+        
+        with self._memory_lock:
+            self.entries = entries
+            self.bytes_used = bytes_used
+    
+    def _report_error(self, operation, error):
+        self.errors += 1
+        # The first failure and then every 1000th, so a dead disk doesn't flood the logs
+        if self.errors == 1 or self.errors % 1000 == 0:
+            print(f"[!] LLM verdict store {operation} failed ({self.errors} errors so far): {error}")
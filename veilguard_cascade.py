@@ -0,0 +1,354 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+
+from veilguard import detect_jailbreak as keyword_detect, normalize_input
+from veilguard_metrics import timed
+
+# Embedding scores in [low, high) are uncertain and go to the LLM
+# (VEILGUARD_CASCADE_BAND_LOW / VEILGUARD_CASCADE_BAND_HIGH). Below 0.40 the
+# ML layer says NONE, from 0.60 up HIGH/CRITICAL: only LOW and MEDIUM are asked.
+DEFAULT_BAND_LOW = 0.40
+DEFAULT_BAND_HIGH = 0.60
+
+# Whole-request latency budget (VEILGUARD_CASCADE_BUDGET_MS); the LLM tier
+# only gets what the keyword and embedding tiers left of it
+DEFAULT_LATENCY_BUDGET_MS = 1500
+
+# With less budget than this left, the LLM isn't even tried
+MIN_LLM_BUDGET_MS = 50
+
+# LLM calls per tenant per window (VEILGUARD_CASCADE_TENANT_LLM_CALLS /
+# VEILGUARD_CASCADE_TENANT_WINDOW_S)
+DEFAULT_TENANT_LLM_CALLS = 1000
+DEFAULT_TENANT_WINDOW_S = 3600
+
+# LLM calls per window across all tenants, per worker process
+# (VEILGUARD_CASCADE_LLM_CALLS); 0 means never escalate
+DEFAULT_GLOBAL_LLM_CALLS = 10000
+
+# Tenant windows kept, least recently used dropped first
+MAX_TRACKED_TENANTS = 10000
+
+DEFAULT_TENANT = "default"
+
+class TenantBudget:
+    """
+    Fixed-window allowance of LLM calls per tenant, under a global cap
+    
+    Every tenant gets `calls` LLM calls per `window_seconds`, and all tenants
+    together get `global_calls`. VEILGUARD_CASCADE_TENANT_BUDGETS (JSON
+    object, e.g. {"acme": 20000}) names the known tenants and their
+    allowances; 0 means never escalate. The tenant ID comes from an
+    unauthenticated header, so any other ID is charged to "default" -
+    rotating IDs doesn't buy more calls.
+    
+    Only touched from the event loop, so no lock needed.
+    """
+    
+    def __init__(self, calls=None, window_seconds=None, overrides=None, global_calls=None):
+        self.calls = max(0, int(
+            calls if calls is not None
+            else os.getenv('VEILGUARD_CASCADE_TENANT_LLM_CALLS') or DEFAULT_TENANT_LLM_CALLS
+        ))
+        self.global_calls = max(0, int(
+            global_calls if global_calls is not None
+            else os.getenv('VEILGUARD_CASCADE_LLM_CALLS') or DEFAULT_GLOBAL_LLM_CALLS
+        ))
+        self.window = float(
+            window_seconds or os.getenv('VEILGUARD_CASCADE_TENANT_WINDOW_S') or DEFAULT_TENANT_WINDOW_S
+        )
+        if overrides is None:
+            overrides = json.loads(os.getenv('VEILGUARD_CASCADE_TENANT_BUDGETS') or '{}')
+        self.overrides = {str(tenant): int(calls) for tenant, calls in overrides.items()}
+        
+        # tenant -> [window start, calls used], least recently used first
+        self._windows = OrderedDict()
+        # [window start, calls used] across all tenants
+        self._global = [time.monotonic(), 0]
+        self.denied = 0
+        self.denied_global = 0
+    
+    def resolve(self, tenant):
+        """
+        The tenant a request is charged to: itself if configured, else "default"
+        """
+        return tenant if tenant in self.overrides else DEFAULT_TENANT
+    
+    def limit(self, tenant):
+        return self.overrides.get(tenant, self.calls)
+    
+    def spend(self, tenant):
+        """
+        Take one LLM call from the tenant's allowance and the global cap
+        
+        Returns:
+            str: None if the call was taken, else the llm_status saying why
+            not ("tenant_budget" or "global_budget")
+        """
+        window = self._window(tenant)
+        if window[1] >= self.limit(tenant):
+            self.denied += 1
+            return "tenant_budget"
+        total = self._global_window()
+        if total[1] >= self.global_calls:
+            self.denied_global += 1
+            return "global_budget"
+        window[1] += 1
+        total[1] += 1
+        return None
+    
+    def refund(self, tenant):
+        """
+        Give a call back (it was answered from the verdict store, or never made)
+        """
+        window = self._windows.get(tenant)
+        if window is not None and window[1] > 0:
+            window[1] -= 1
+        if self._global[1] > 0:
+            self._global[1] -= 1
+    
+    def remaining(self, tenant):
+        return max(0, min(
+            self.limit(tenant) - self._window(tenant)[1],
+            self.global_calls - self._global_window()[1]
+        ))
+    
+    def stats(self):
+        return {
+            "calls_per_window": self.calls,
+            "global_calls_per_window": self.global_calls,
+            "global_calls_used": self._global_window()[1],
+            "window_seconds": self.window,
+            "overrides": len(self.overrides),
+            "tenants": len(self._windows),
+            "denied": self.denied,
+            "denied_global": self.denied_global
+        }
+    
+    def _window(self, tenant):
+        now = time.monotonic()
+        window = self._windows.get(tenant)
+        if window is None or now - window[0] >= self.window:
+            window = self._windows[tenant] = [now, 0]
+        self._windows.move_to_end(tenant)
+        while len(self._windows) > MAX_TRACKED_TENANTS:
+            self._windows.popitem(last=False)
+        return window
+    
+    def _global_window(self):
+        now = time.monotonic()
+        if now - self._global[0] >= self.window:
+            self._global = [now, 0]
+        return self._global
+
+class VeilGuardCascade:
+    """
+    VeilGuard Cascade Engine
+    Keyword -> embedding -> LLM, each tier only when the one before is unsure
+    
+    1. Keyword: a pattern match blocks right away (no encoder, no LLM).
+    2. Embedding: the ML layer (micro-batched like /check). A score below
+       band_low is safe and from band_high up is blocked, both final.
+    3. LLM: only scores inside [band_low, band_high) are escalated, and
+       only if the request's latency budget and the tenant's LLM allowance
+       allow it. The LLM verdict then decides, both ways.
+    
+    Whenever the LLM can't decide (no LLM configured, budget spent,
+    timeout, error, circuit open), the embedding verdict stands. A call
+    cut off by the latency budget keeps running in the background and its
+    verdict lands in the LLM verdict store, so the next identical input is
+    answered from the store.
+    
+    Every result carries a "cascade" block: tiers_run, decided_by,
+    llm_status, per-tier timings_ms, latency budget and the tenant's
+    remaining LLM calls.
+    
+    Settings (explicit args win): VEILGUARD_CASCADE_BAND_LOW (0.40),
+    VEILGUARD_CASCADE_BAND_HIGH (0.60), VEILGUARD_CASCADE_BUDGET_MS (1500),
+    plus the TenantBudget variables.
+    """
+    
+    def __init__(self, hybrid, llm=None, band_low=None, band_high=None, latency_budget_ms=None,
+                 tenant_budget=None):
+        self.hybrid = hybrid
+        self.llm = llm
+        self.band_low = float(
+            band_low if band_low is not None
+            else os.getenv('VEILGUARD_CASCADE_BAND_LOW') or DEFAULT_BAND_LOW
+        )
+        self.band_high = float(
+            band_high if band_high is not None
+            else os.getenv('VEILGUARD_CASCADE_BAND_HIGH') or DEFAULT_BAND_HIGH
+        )
+        if self.band_low > self.band_high:
+            raise ValueError(f"Cascade band is empty: low {self.band_low} > high {self.band_high}")
+        self.latency_budget_ms = float(
+            latency_budget_ms or os.getenv('VEILGUARD_CASCADE_BUDGET_MS') or DEFAULT_LATENCY_BUDGET_MS
+        )
+        self.tenant_budget = tenant_budget if tenant_budget is not None else TenantBudget()
+        
+        # Counters
+        self.requests = 0
+        self.decided_by = {"keyword": 0, "embedding": 0, "llm": 0}
+        self.llm_status = {}
+        
+        print(f"[+] VeilGuard Cascade ready! (band [{self.band_low}, {self.band_high}), "
+              f"budget {self.latency_budget_ms:g} ms, llm={'on' if self.llm is not None else 'off'})")
+    
+    async def detect_async(self, user_input, ml_batcher, tenant="default", latency_budget_ms=None):
+        """
+        Run the cascade on one input
+        
+        Args:
+            user_input (str): The text to analyze
+            ml_batcher (MicroBatcher): Batcher wrapping the ML detector's detect_many
+            tenant (str): Claimed tenant ID; an escalation is charged to it
+                if it's a configured tenant, else to "default"
+            latency_budget_ms (float): This request's budget (default: the engine's)
+        
+        Returns:
+            dict: Hybrid-style verdict plus a "cascade" block
+        """
+        started = time.perf_counter()
+        budget_ms = float(latency_budget_ms or self.latency_budget_ms)
+        tenant = self.tenant_budget.resolve(tenant)
+        cascade = {
+            "tiers_run": ["keyword"],
+            "decided_by": "keyword",
+            "llm_status": "not_needed",
+            "timings_ms": {},
+            "latency_budget_ms": budget_ms,
+            "tenant": tenant
+        }
+        self.requests += 1
+        
+        # Tier 1: keyword (microseconds, inline)
+        tier_started = time.perf_counter()
+        with timed("normalize"):
+            normalized = normalize_input(user_input)
+        with timed("keyword"):
+            keyword_result = keyword_detect(normalized)
+        cascade["timings_ms"]["keyword"] = _elapsed_ms(tier_started)
+        
+        if keyword_result["blocked"]:
+            with timed("merge"):
+                result = self.hybrid.combine(keyword_result, None, "keyword_short_circuit")
+            return self._finish(result, cascade, started)
+        
+        # Tier 2: embedding (shares encoder batches with /check)
+        cascade["tiers_run"].append("embedding")
+        cascade["decided_by"] = "embedding"
+        tier_started = time.perf_counter()
+        with timed("ml_wait"):
+            ml_result = await ml_batcher.submit(normalized.raw)
+        cascade["timings_ms"]["embedding"] = _elapsed_ms(tier_started)
+        with timed("merge"):
+            result = self.hybrid.combine(keyword_result, ml_result)
+        
+        if not self.band_low <= ml_result["similarity_score"] < self.band_high:
+            return self._finish(result, cascade, started)
+        
+        # Tier 3: LLM, within what's left of the budget, the tenant's allowance
+        # and the global cap
+        remaining_ms = budget_ms - _elapsed_ms(started)
+        if self.llm is None:
+            cascade["llm_status"] = "disabled"
+        elif remaining_ms < MIN_LLM_BUDGET_MS:
+            cascade["llm_status"] = "over_budget"
+        else:
+            denied = self.tenant_budget.spend(tenant)
+            if denied is not None:
+                cascade["llm_status"] = denied
+            else:
+                cascade["tiers_run"].append("llm")
+                tier_started = time.perf_counter()
+                llm_result = await self._ask_llm(normalized.raw, remaining_ms, tenant, cascade)
+                cascade["timings_ms"]["llm"] = _elapsed_ms(tier_started)
+                if llm_result is not None:
+                    self._apply_llm(result, llm_result)
+                    cascade["decided_by"] = "llm"
+        
+        return self._finish(result, cascade, started)
+    
+    def stats(self):
+        """
+        Tier and LLM counters, for /health and monitoring
+        """
+        return {
+            "band": [self.band_low, self.band_high],
+            "latency_budget_ms": self.latency_budget_ms,
+            "requests": self.requests,
+            "decided_by": dict(self.decided_by),
+            "llm_status": dict(self.llm_status),
+            "tenant_budget": self.tenant_budget.stats(),
+            "llm": self.llm.stats() if self.llm is not None else None
+        }
+    
+    async def _ask_llm(self, text, remaining_ms, tenant, cascade):
+        """
+        LLM verdict within the remaining budget, or None (llm_status says why)
+        """
+        try:
+            # Shielded: past the budget we stop waiting, but the call finishes
+            # and its verdict is stored for the next identical input
+            llm_result = await asyncio.wait_for(asyncio.shield(self.llm.detect(text)), remaining_ms / 1000)
+        except asyncio.TimeoutError:
+            cascade["llm_status"] = "timeout"
+            return None
+        
+        if llm_result["detection_method"] == "llm_unavailable":
+            # Circuit open: no call was made
+            self.tenant_budget.refund(tenant)
+            cascade["llm_status"] = "unavailable"
+            return None
+        if llm_result["detection_method"] != "llm":
+            cascade["llm_status"] = "error"
+            return None
+        
+        if llm_result.get("cached"):
+            self.tenant_budget.refund(tenant)
+            cascade["llm_status"] = "cached"
+        else:
+            cascade["llm_status"] = "answered"
+        return llm_result
+    
+    def _apply_llm(self, result, llm_result):
+        """
+        Let the LLM verdict decide an uncertain input (block or clear it)
+        """
+        blocked = llm_result["blocked"]
+        result["blocked"] = blocked
+        result["status"] = "🚨 THREAT DETECTED" if blocked else "✅ SAFE"
+        result["risk_level"] = llm_result["risk_level"]
+        result["confidence"] = f"llm_{llm_result['confidence']:.2f}"
+        result["detection_method"] = "llm" if blocked else "none"
+        if blocked:
+            result["patterns_found"].append(f"LLM: {llm_result.get('attack_type', 'unknown')}")
+        else:
+            # The LLM overrules a MEDIUM embedding match
+            result["patterns_found"] = [
+                pattern for pattern in result["patterns_found"] if not pattern.startswith("ML: ")
+            ]
+        result["layers_run"].append("llm")
+        result["layers"]["llm"] = {
+            "detected": blocked,
+            "risk": llm_result["risk_level"],
+            "confidence": llm_result["confidence"],
+            "attack_type": llm_result.get("attack_type", "none"),
+            "reason": llm_result.get("reason", ""),
+            "cached": bool(llm_result.get("cached"))
+        }
+    
+    def _finish(self, result, cascade, started):
+        cascade["timings_ms"]["total"] = _elapsed_ms(started)
+        cascade["tenant_llm_remaining"] = self.tenant_budget.remaining(cascade["tenant"])
+        self.decided_by[cascade["decided_by"]] += 1
+        self.llm_status[cascade["llm_status"]] = self.llm_status.get(cascade["llm_status"], 0) + 1
+        result["cascade"] = cascade
+        return result
+
+def _elapsed_ms(started):
+    return round((time.perf_counter() - started) * 1000, 3)
@@ -0,0 +1,329 @@
+import codecs
+import os
+
+from veilguard import NormalizedInput, detect_jailbreak as keyword_detect, env_flag
+
+# Window geometry, in whitespace-separated words. 128 words of English
+# prose fit MiniLM's 256-token window; windows that tokenize longer (long
+# words, code, non-Latin scripts) are split until they fit before encoding
+# (DocumentScanner._fit_windows), so nothing is silently truncated. The
+# overlap is longer than any keyword pattern, so no match is lost at a boundary.
+DEFAULT_WINDOW_WORDS = 128
+DEFAULT_OVERLAP_WORDS = 32
+
+# Windows detected per batch (one encoder pass); early exit is checked between batches
+DEFAULT_BATCH_WINDOWS = 32
+
+# Streamed bodies larger than this are rejected (VEILGUARD_DOC_MAX_MB)
+DEFAULT_MAX_MB = 50
+
+# A "word" longer than this (e.g. base64 blobs) is cut so it can't grow unbounded
+MAX_WORD_CHARS = 2048
+
+RISK_LEVELS = ["NONE", "LOW", "MEDIUM", "HIGH", "CRITICAL"]
+
+class DocumentTooLargeError(Exception):
+    """
+    Raised when a streamed document exceeds the configured size limit
+    """
+
+def _severity(result):
+    """
+    Sort key for window verdicts: blocked first, then risk, then ML score
+    """
+    return (result["blocked"], RISK_LEVELS.index(result["risk_level"]), result["ml_similarity_score"] or 0.0)
+
+class DocumentScan:
+    """
+    State of one document scan: pending words, windows and the worst verdict so far
+    
+    Text is fed in pieces (whole string or streamed chunks). Words are
+    grouped into overlapping windows; full batches of windows are handed
+    back to the caller to detect, so a scan never holds more than one
+    batch of windows plus one window of words in memory.
+    """
+    
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.stride = scanner.window_words - scanner.overlap_words
+        
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._partial = ""
+        self._words = []
+        self._words_start = 0
+        self._pending = []
+        
+        self.characters = 0
+        self.word_count = 0
+        self.windows_scanned = 0
+        self.patterns = []
+        self.worst = None
+        self.worst_window = None
+    
+    @property
+    def blocked(self):
+        return self.worst is not None and self.worst["blocked"]
+    
+    def feed_bytes(self, chunk):
+        """
+        Feed raw UTF-8 bytes (may split multi-byte characters); returns ready batches
+        """
+        return self.feed(self._decoder.decode(chunk))
+    
+    def feed(self, text):
+        """
+        Feed decoded text (may split words); returns a list of ready window batches
+        """
+        self.characters += len(text)
+        text = self._partial + text
+        words = text.split()
+        
+        # The last word may continue in the next chunk
+        if words and not text[-1].isspace():
+            self._partial = words.pop()
+            if len(self._partial) > MAX_WORD_CHARS:
+                words.append(self._partial)
+                self._partial = ""
+        else:
+            self._partial = ""
+        
+        self.word_count += len(words)
+        self._words.extend(words)
+        return self._cut_windows(final=False)
+    
+    def finish(self):
+        """
+        Flush the trailing words; returns the last (possibly partial) batches
+        """
+        self._partial += self._decoder.decode(b"", final=True)
+        if self._partial.strip():
+            self._words.append(self._partial.strip())
+            self.word_count += 1
+        self._partial = ""
+        return self._cut_windows(final=True)
+    
+    def add_results(self, batch, results):
+        """
+        Merge the detector's verdicts for one batch of windows
+        """
+        first_index = self.windows_scanned
+        self.windows_scanned += len(batch)
+        for offset, ((start_word, text), result) in enumerate(zip(batch, results)):
+            for pattern in result["patterns_found"]:
+                if pattern not in self.patterns:
+                    self.patterns.append(pattern)
+            if self.worst is None or _severity(result) > _severity(self.worst):
+                self.worst = result
+                self.worst_window = {
+                    "index": first_index + offset,
+                    "start_word": start_word,
+                    "excerpt": text[:200]
+                }
+    
+    def result(self, early_exit):
+        """
+        Document verdict: the worst window's verdict plus document statistics
+        """
+        if self.worst is not None:
+            result = dict(self.worst)
+        else:
+            # Empty document: nothing to encode
+            detector = self.scanner.detector
+            result = detector.combine(keyword_detect(""), None, ml_skipped="empty")
+        result["patterns_found"] = list(self.patterns)
+        result["document"] = {
+            "characters": self.characters,
+            "words": self.word_count,
+            "windows_scanned": self.windows_scanned,
+            "early_exit": early_exit,
+            "matched_window": self.worst_window if result["blocked"] else None
+        }
+        return result
+    
+    def _cut_windows(self, final):
+        batches = []
+        window_words = self.scanner.window_words
+        while len(self._words) >= window_words:
+            self._pending.append((self._words_start, ' '.join(self._words[:window_words])))
+            del self._words[:self.stride]
+            self._words_start += self.stride
+            if len(self._pending) >= self.scanner.batch_windows:
+                batches.append(self._pending)
+                self._pending = []
+        
+        if final:
+            # Tail words not already covered by the last full window
+            covered = self.scanner.overlap_words if self._words_start else 0
+            if len(self._words) > covered or (not self.windows_scanned and not self._pending and self._words):
+                self._pending.append((self._words_start, ' '.join(self._words)))
+            self._words = []
+            if self._pending:
+                batches.append(self._pending)
+                self._pending = []
+        return batches
+
+class DocumentScanner:
+    """
+    VeilGuard Document Scanner
+    Long-document mode: overlapping windows, batched detection, max-pooling
+    
+    Single-input detection sees at most the encoder's token window (MiniLM
+    truncates everything after ~256 tokens). Here the document is split into
+    overlapping word windows. Windows longer than the encoder's token window
+    are split (with overlap) until every piece fits. Each batch of windows
+    goes through VeilGuardHybrid.detect_many() (keyword + ML, one encoder
+    pass, verdict cache). The document verdict is the worst window's
+    verdict (max-pool).
+    
+    With early_exit (the default), scanning stops at the first batch
+    containing a blocked window: the document is blocked either way.
+    
+    scan() takes a whole string; scan_stream() takes an async iterator of
+    byte chunks (e.g. request.stream()), so a multi-megabyte body is never
+    fully buffered.
+    
+    Settings (explicit args win): VEILGUARD_DOC_WINDOW_WORDS (128),
+    VEILGUARD_DOC_OVERLAP_WORDS (32), VEILGUARD_DOC_BATCH_WINDOWS (32),
+    VEILGUARD_DOC_EARLY_EXIT (on), VEILGUARD_DOC_MAX_MB (50).
+    """
+    
+    def __init__(self, detector, window_words=None, overlap_words=None, batch_windows=None,
+                 early_exit=None, max_mb=None):
+        self.detector = detector
+        self.window_words = max(1, int(
+            window_words or os.getenv('VEILGUARD_DOC_WINDOW_WORDS') or DEFAULT_WINDOW_WORDS
+        ))
+        self.overlap_words = min(self.window_words - 1, max(0, int(
+            overlap_words if overlap_words is not None
+            else os.getenv('VEILGUARD_DOC_OVERLAP_WORDS') or DEFAULT_OVERLAP_WORDS
+        )))
+        self.batch_windows = max(1, int(
+            batch_windows or os.getenv('VEILGUARD_DOC_BATCH_WINDOWS') or DEFAULT_BATCH_WINDOWS
+        ))
+        self.early_exit = env_flag('VEILGUARD_DOC_EARLY_EXIT', True) if early_exit is None else early_exit
+        self.max_bytes = int(float(
+            max_mb or os.getenv('VEILGUARD_DOC_MAX_MB') or DEFAULT_MAX_MB
+        ) * 1024 * 1024)
+    
+    def scan(self, text):
+        """
+        Scan a whole document string
+        
+        Returns:
+            dict: Hybrid-style verdict of the worst window, plus a "document" block
+        """
+        scan = DocumentScan(self)
+        batches = scan.feed(text) + scan.finish()
+        for batch in batches:
+            scan.add_results(*self._detect(batch))
+            if self.early_exit and scan.blocked:
+                return scan.result(early_exit=True)
+        return scan.result(early_exit=False)
+    
+    async def scan_stream(self, chunks, executor):
+        """
+        Scan a streamed document (async iterator of UTF-8 byte chunks)
+        
+        Detection batches run on the inference executor; reading stops as
+        soon as a batch blocks (with early_exit) or the size limit is hit.
+        
+        Raises:
+            DocumentTooLargeError: If the body exceeds max_bytes
+            QueueFullError: If the inference executor is saturated
+        """
+        scan = DocumentScan(self)
+        received = 0
+        
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > self.max_bytes:
+                raise DocumentTooLargeError(
+                    f"Document exceeds {self.max_bytes // (1024 * 1024)} MB"
+                )
+            for batch in scan.feed_bytes(chunk):
+                scan.add_results(*await executor.run(self._detect, batch))
+                if self.early_exit and scan.blocked:
+                    return scan.result(early_exit=True)
+        
+        for batch in scan.finish():
+            scan.add_results(*await executor.run(self._detect, batch))
+            if self.early_exit and scan.blocked:
+                return scan.result(early_exit=True)
+        return scan.result(early_exit=False)
+    
+    def _detect(self, batch):
+        """
+        Detect one batch of windows; returns (the windows actually detected, their verdicts)
+        """
+        batch = self._fit_windows(batch)
+        return batch, self.detector.detect_many([NormalizedInput(text) for _, text in batch])
+    
+    def _fit_windows(self, batch):
+        """
+        Split windows that don't fit the encoder's token window, in document order
+        
+        Token counts come from VeilGuardML.token_lengths(), which stops at
+        max_seq_length, so a window reaching it may have been cut and is split.
+        """
+        ml_detector = self.detector.ml_detector
+        limit = ml_detector.model.max_seq_length
+        fitted = []
+        pending = list(batch)
+        while pending:
+            lengths = ml_detector.token_lengths([text for _, text in pending])
+            overflowing = []
+            for window, length in zip(pending, lengths):
+                pieces = self._split_window(*window, limit) if length >= limit else None
+                if pieces is None:
+                    fitted.append(window)
+                else:
+                    overflowing.extend(pieces)
+            pending = overflowing
+        
+        # Stable sort: split pieces go back to their place in the document
+        fitted.sort(key=lambda window: window[0])
+        return fitted
+    
+    def _split_window(self, start_word, text, limit):
+        """
+        Overlapping pieces of a window, packed by per-word token counts, or None if it can't be split
+        
+        A single word longer than the token window is cut by characters.
+        """
+        words = text.split()
+        # Room for the words of one piece: the window minus [CLS]/[SEP], with some slack
+        budget = max(1, int((limit - 2) * 0.9))
+        
+        if len(words) == 1:
+            if len(text) < 2:
+                return None
+            (tokens,) = self.detector.ml_detector.token_lengths([text])
+            parts = max(2, -(-tokens // budget))
+            size = -(-len(text) // parts)
+            return [(start_word, text[offset:offset + size]) for offset in range(0, len(text), size)]
+        
+        counts = [max(1, length - 2) for length in self.detector.ml_detector.token_lengths(words)]
+        pieces = []
+        first = 0
+        while first < len(words):
+            last = first
+            used = 0
+            while last < len(words) and (last == first or used + counts[last] <= budget):
+                used += counts[last]
+                last += 1
+            if first == 0 and last == len(words):
+                # Word counts say it fits but the whole window didn't: halve it
+                last = len(words) // 2
+            pieces.append((start_word + first, ' '.join(words[first:last])))
+            if last == len(words):
+                break
+            
+            # Step back over up to overlap_words words (at most a quarter of the budget)
+            next_first = last
+            overlap_tokens = 0
+            while (next_first - 1 > first and last - next_first < self.overlap_words
+                   and overlap_tokens + counts[next_first - 1] <= budget // 4):
+                next_first -= 1
+                overlap_tokens += counts[next_first]
+            first = next_first
+        return pieces
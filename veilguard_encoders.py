@@ -0,0 +1,444 @@
+import bisect
+import itertools
+import json
+import os
+import time
+
+import numpy as np
+
+from veilguard_metrics import observe_tokens
+
+# Encoder backends selectable via VEILGUARD_ENCODER_BACKEND
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_BACKEND = "torch"
+
+# Where exported ONNX models live (one sub-directory per model)
+DEFAULT_ONNX_DIR = "onnx_models"
+
+# File names inside an exported model directory
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_INT8_MODEL_FILE = "model_int8.onnx"
+ONNX_CONFIG_FILE = "veilguard_onnx.json"
+
+# Characters kept per token of the encoder window before tokenizing
+# (VEILGUARD_ENCODE_CHARS_PER_TOKEN, 0 = no cap). English averages 4-5
+# characters per WordPiece token, so at 12 the cut lands far past the last
+# token the model can see; only the tokenizer's time on the tail is saved.
+DEFAULT_CHARS_PER_TOKEN = 12
+
+# Inputs per forward pass
+DEFAULT_ENCODE_BATCH_SIZE = 32
+
+# Token-length bucket boundaries (VEILGUARD_LENGTH_BUCKETS, comma-separated,
+# 0 = no buckets). Inputs from different buckets never share a forward pass,
+# so one long prompt doesn't pad a batch of short ones to its length.
+DEFAULT_LENGTH_BUCKETS = (16, 32, 64, 128)
+
+# Rough characters per token, for encoders without a tokenizer in this
+# process (worker pool, encoder server)
+ESTIMATED_CHARS_PER_TOKEN = 4
+
+def char_budget(max_seq_length):
+    """
+    Character cap for inputs to an encoder with this token window (0 = no cap)
+    """
+    chars_per_token = float(os.getenv('VEILGUARD_ENCODE_CHARS_PER_TOKEN') or DEFAULT_CHARS_PER_TOKEN)
+    return int(max_seq_length * chars_per_token)
+
+def cap_chars(texts, budget):
+    """
+    Cut each text at budget characters (whitespace-stripped first, like sentence-transformers)
+    """
+    if not budget:
+        return [text.strip() for text in texts]
+    return [text.strip()[:budget] for text in texts]
+
+def length_buckets(boundaries=None):
+    """
+    Sorted token-length bucket boundaries (explicit, VEILGUARD_LENGTH_BUCKETS or the default)
+    
+    Bucket i holds lengths up to boundaries[i]; the last bucket everything longer.
+    """
+    if boundaries is None:
+        setting = os.getenv('VEILGUARD_LENGTH_BUCKETS')
+        boundaries = setting.split(',') if setting else DEFAULT_LENGTH_BUCKETS
+    return tuple(sorted({int(boundary) for boundary in boundaries if int(boundary) > 0}))
+
+def bucket_of(length, boundaries):
+    return bisect.bisect_left(boundaries, length)
+
+def estimate_token_lengths(texts, max_seq_length):
+    """
+    Token counts guessed from character counts (capped at the token window)
+    """
+    return [
+        min(max_seq_length, len(text.strip()) // ESTIMATED_CHARS_PER_TOKEN + 2)
+        for text in texts
+    ]
+
+def length_sorted_batches(lengths, batch_size, boundaries=()):
+    """
+    Indices grouped into batches of similar token length, so each batch pads as little as possible
+    
+    Batches never mix length buckets: a short input is never padded to a
+    long one from another bucket just to fill up a batch.
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = []
+    for _, bucket in itertools.groupby(order, key=lambda index: bucket_of(lengths[index], boundaries)):
+        bucket = list(bucket)
+        batches.extend(bucket[start:start + batch_size] for start in range(0, len(bucket), batch_size))
+    return batches
+
+def get_onnx_dir(model_name):
+    """
+    Directory holding the exported ONNX files for a model
+    
+    VEILGUARD_ONNX_DIR (default ./onnx_models) / <model name with "/" -> "__">
+    """
+    root = os.getenv('VEILGUARD_ONNX_DIR') or DEFAULT_ONNX_DIR
+    return os.path.join(root, model_name.strip('/').replace('/', '__'))
+
+class TorchEncoder:
+    """
+    PyTorch backend: the original SentenceTransformer pipeline
+    
+    Tokenization is done here rather than in SentenceTransformer.encode():
+    inputs are capped at char_budget() characters, the whole list goes
+    through the fast tokenizer in one batch call (truncated to the model's
+    token window), and batches are formed by exact token length instead of
+    character length, never mixing length buckets (length_buckets()). The
+    forward pass and pooling are the model's own, so embeddings match
+    model.encode().
+    """
+    
+    backend = "torch"
+    
+    def __init__(self, model_name):
+        # Imported lazily so the ONNX backend never loads torch
+        from sentence_transformers import SentenceTransformer
+        
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.max_seq_length = self.model.max_seq_length
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        
+        self.transformer = self.model._first_module()
+        self.tokenizer = self.transformer.tokenizer
+        self.char_budget = char_budget(self.max_seq_length)
+        self.length_buckets = length_buckets()
+    
+    def token_lengths(self, texts):
+        """
+        Token count of each text as encode() sees it (at most max_seq_length)
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        return [len(ids) for ids in self._tokenize(texts)["input_ids"]]
+    
+    def encode(self, texts, batch_size=DEFAULT_ENCODE_BATCH_SIZE):
+        """
+        Embed a list of texts
+        
+        Returns:
+            np.ndarray: float32 matrix, one row per text
+        """
+        import torch
+        
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        
+        tokenized = self._tokenize(texts)
+        lengths = [len(ids) for ids in tokenized["input_ids"]]
+        embeddings = np.empty((len(texts), self.dimension), dtype=np.float32)
+        padded_tokens = 0
+        
+        for batch in length_sorted_batches(lengths, batch_size, self.length_buckets):
+            width = max(lengths[index] for index in batch)
+            padded_tokens += width * len(batch)
+            
+            features = {}
+            for name, values in tokenized.items():
+                pad_value = self.tokenizer.pad_token_id if name == "input_ids" else 0
+                matrix = np.full((len(batch), width), pad_value, dtype=np.int64)
+                for row, index in enumerate(batch):
+                    matrix[row, :lengths[index]] = values[index]
+                features[name] = torch.from_numpy(matrix).to(self.model.device)
+            with torch.no_grad():
+                pooled = self.model.forward(features)["sentence_embedding"]
+            embeddings[batch] = pooled.detach().cpu().numpy()
+        
+        observe_tokens(sum(lengths), padded_tokens, sum(length >= self.max_seq_length for length in lengths))
+        return embeddings
+    
+    def _tokenize(self, texts):
+        texts = cap_chars(texts, self.char_budget)
+        if getattr(self.transformer, "do_lower_case", False):
+            texts = [text.lower() for text in texts]
+        return self.tokenizer(texts, truncation=True, max_length=self.max_seq_length)
+
+class OnnxEncoder:
+    """
+    ONNX Runtime backend (CPU), fp32 or dynamic int8-quantized
+    
+    Runs the exported transformer with onnxruntime and reproduces the
+    sentence-transformers post-processing (mean pooling over the attention
+    mask, then L2 normalization) in numpy. Tokenization uses the Rust
+    `tokenizers` library, so neither torch nor transformers is imported.
+    """
+    
+    def __init__(self, model_name, quantized=False, model_dir=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+        
+        self.model_name = model_name
+        self.backend = "onnx-int8" if quantized else "onnx"
+        model_dir = model_dir or get_onnx_dir(model_name)
+        
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE)) as config_file:
+            config = json.load(config_file)
+        self.max_seq_length = config["max_seq_length"]
+        self.normalize = config["normalize"]
+        
+        model_path = os.path.join(model_dir, ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"{model_path} not found - run: python -m veilguard_encoders export --model {model_name}"
+            )
+        
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = os.getenv('VEILGUARD_ONNX_THREADS')
+        if threads:
+            options.intra_op_num_threads = int(threads)
+        self.session = onnxruntime.InferenceSession(
+            model_path, options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        self.dimension = config.get("dimension") or self.session.get_outputs()[0].shape[-1]
+        
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.no_padding()
+        self.pad_id = config.get("pad_token_id", 0)
+        self.char_budget = char_budget(self.max_seq_length)
+        self.length_buckets = length_buckets()
+    
+    def token_lengths(self, texts):
+        """
+        Token count of each text as encode() sees it (at most max_seq_length)
+        """
+        texts = cap_chars(list(texts), self.char_budget)
+        if not texts:
+            return []
+        return [len(encoding.ids) for encoding in self.tokenizer.encode_batch(texts)]
+    
+    def encode(self, texts, batch_size=DEFAULT_ENCODE_BATCH_SIZE):
+        """
+        Embed a list of texts
+        
+        Returns:
+            np.ndarray: float32 matrix, one row per text
+        """
+        texts = cap_chars(list(texts), self.char_budget)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        
+        encodings = self.tokenizer.encode_batch(texts)
+        lengths = [len(encoding.ids) for encoding in encodings]
+        embeddings = [None] * len(texts)
+        padded_tokens = 0
+        
+        # Sort by length (within length buckets) so each batch pads as little as possible
+        for indices in length_sorted_batches(lengths, batch_size, self.length_buckets):
+            batch = [encodings[index] for index in indices]
+            width = max(len(encoding.ids) for encoding in batch)
+            padded_tokens += width * len(batch)
+            
+            input_ids = np.full((len(batch), width), self.pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            token_type_ids = np.zeros((len(batch), width), dtype=np.int64)
+            for row, encoding in enumerate(batch):
+                length = len(encoding.ids)
+                input_ids[row, :length] = encoding.ids
+                attention_mask[row, :length] = 1
+                token_type_ids[row, :length] = encoding.type_ids
+            
+            feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+            if "token_type_ids" in self.input_names:
+                feed["token_type_ids"] = token_type_ids
+            token_embeddings = self.session.run(None, feed)[0]
+            
+            # Mean pooling over real (non-padding) tokens
+            mask = attention_mask[:, :, None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            
+            for index, vector in zip(indices, pooled):
+                embeddings[index] = vector
+        
+        observe_tokens(sum(lengths), padded_tokens, sum(length >= self.max_seq_length for length in lengths))
+        return np.stack(embeddings).astype(np.float32, copy=False)
+
+def create_encoder(model_name, backend=None):
+    """
+    Build an encoder for a model on the configured backend
+    
+    Args:
+        model_name (str): Model name or local path
+        backend (str): torch, onnx or onnx-int8. Defaults to VEILGUARD_ENCODER_BACKEND or torch
+    """
+    backend = backend or os.getenv('VEILGUARD_ENCODER_BACKEND') or DEFAULT_BACKEND
+    if backend == "torch":
+        return TorchEncoder(model_name)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEncoder(model_name, quantized=(backend == "onnx-int8"))
+    raise ValueError(f"Unknown encoder backend: {backend} (choose from {', '.join(BACKENDS)})")
+
+def export_onnx(model_name, output_dir=None, quantize=True, opset=17):
+    """
+    Export a sentence-transformer to ONNX (plus a dynamic int8 variant)
+    
+    Writes model.onnx, model_int8.onnx (if quantize), tokenizer.json and
+    veilguard_onnx.json into output_dir. Needs torch; the exported files don't.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+    
+    output_dir = output_dir or get_onnx_dir(model_name)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+    if pooling is None or pooling.get_pooling_mode_str() != "mean":
+        raise ValueError("Only mean-pooling sentence-transformers can be exported")
+    
+    print(f"[*] Exporting {model_name} to {output_dir}...")
+    transformer.tokenizer.save_pretrained(output_dir)
+    
+    auto_model = transformer.auto_model.eval()
+    sample = transformer.tokenizer(["VeilGuard export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    
+    model_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            tuple(sample[name] for name in input_names),
+            model_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            dynamo=False
+        )
+    
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w") as config_file:
+        json.dump({
+            "model_name": model_name,
+            "max_seq_length": model.max_seq_length,
+            "normalize": any(isinstance(module, Normalize) for module in model),
+            "dimension": model.get_sentence_embedding_dimension(),
+            "pad_token_id": transformer.tokenizer.pad_token_id or 0
+        }, config_file, indent=2)
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        print("[*] Quantizing to int8...")
+        quantize_dynamic(model_path, os.path.join(output_dir, ONNX_INT8_MODEL_FILE), weight_type=QuantType.QInt8)
+    
+    print("[+] Export complete!")
+    return output_dir
+
+def _max_similarities(embeddings, threat_embeddings):
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    threat_embeddings = threat_embeddings / np.linalg.norm(threat_embeddings, axis=1, keepdims=True)
+    return (embeddings @ threat_embeddings.T).max(axis=1)
+
+def _latency_ms(encoder, texts, rounds=20):
+    timings = []
+    for _ in range(rounds):
+        for text in texts:
+            started = time.perf_counter()
+            encoder.encode([text])
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+
+def check_parity(model_name, backend, tolerance=0.05):
+    """
+    Compare a backend's similarity scores with the torch backend
+    
+    Scores every built-in VeilGuardML test case against the threat patterns
+    on both backends and checks they agree within `tolerance`.
+    
+    Returns:
+        bool: True if every score is within tolerance
+    """
+    from veilguard_ml import MALICIOUS_PATTERNS, TEST_CASES
+    
+    texts = [text for text, _ in TEST_CASES]
+    reference = TorchEncoder(model_name)
+    candidate = create_encoder(model_name, backend)
+    
+    reference_scores = _max_similarities(reference.encode(texts), reference.encode(MALICIOUS_PATTERNS))
+    candidate_scores = _max_similarities(candidate.encode(texts), candidate.encode(MALICIOUS_PATTERNS))
+    
+    print(f"\n{'torch':>8} {backend:>10} {'diff':>8}  input")
+    worst = 0.0
+    for text, expected, actual in zip(texts, reference_scores, candidate_scores):
+        diff = abs(float(expected) - float(actual))
+        worst = max(worst, diff)
+        flag = "" if diff <= tolerance else "  <-- FAIL"
+        print(f"{expected:>8.3f} {actual:>10.3f} {diff:>8.3f}  {text[:40]}{flag}")
+    
+    print(f"\nMax score difference: {worst:.4f} (tolerance {tolerance})")
+    for name, encoder in (("torch", reference), (backend, candidate)):
+        p50, p99 = _latency_ms(encoder, texts)
+        print(f"{name:>10} single-input encode: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+    
+    return worst <= tolerance
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    from veilguard_models import get_model_name
+    
+    parser = argparse.ArgumentParser(description="VeilGuard encoder backends")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = commands.add_parser("export", help="Export the model to ONNX (+ int8)")
+    export_parser.add_argument("--model", default=None, help="Model name/path (default: VEILGUARD_MODEL)")
+    export_parser.add_argument("--output", default=None, help="Output directory")
+    export_parser.add_argument("--no-quantize", action="store_true", help="Skip the int8 variant")
+    
+    parity_parser = commands.add_parser("parity", help="Check ONNX scores match torch")
+    parity_parser.add_argument("--model", default=None)
+    parity_parser.add_argument("--backend", default="onnx-int8", choices=["onnx", "onnx-int8"])
+    parity_parser.add_argument("--tolerance", type=float, default=0.05)
+    
+    args = parser.parse_args()
+    model_name = get_model_name(args.model)
+    
+    print("=" * 70)
+    print("VeilGuard AI - Encoder Backends")
+    print("=" * 70)
+    
+    if args.command == "export":
+        export_onnx(model_name, args.output, quantize=not args.no_quantize)
+    else:
+        passed = check_parity(model_name, args.backend, args.tolerance)
+        print("=" * 70)
+        print("PARITY OK" if passed else "PARITY FAILED")
+        print("=" * 70)
+        sys.exit(0 if passed else 1)
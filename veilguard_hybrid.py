@@ -1,6 +1,21 @@
-from veilguard import detect_jailbreak as keyword_detect
+import hashlib
+
+from veilguard import (
+    detect_jailbreak as keyword_detect, normalize_input, normalize_text, env_flag,
+    get_pattern_matcher
+)
+from veilguard_metrics import timed
 from veilguard_ml import VeilGuardML
 
+# Filler words ignored when deciding whether an input shares any vocabulary
+# with the threat patterns (see the prefilter in VeilGuardHybrid)
+PREFILTER_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'to', 'of', 'in', 'on', 'for', 'with',
+    'is', 'are', 'be', 'been', 'has', 'have', 'do', 'can', 'must', 'now',
+    'i', 'im', 'me', 'my', 'you', 'your', 'we', 'what', 'this', 'that',
+    'as', 'if', 'like', 'just', 'all', 'where', 'there'
+}
+
 class VeilGuardHybrid:
     """
     VeilGuard Hybrid Engine v0.3
@@ -11,30 +26,272 @@ class VeilGuardHybrid:
     - Layer 2: ML semantic analysis (catches sophisticated variations)
     
     If EITHER layer detects a threat, we block it.
+    
+    Cascade policy (both off by default, so every input gets both layers):
+    - short_circuit: skip ML when the keyword layer already found an exact
+      HIGH-risk pattern (the input is blocked either way)
+    - prefilter: skip ML when the input shares no content word with any ML
+      threat pattern (cheap "trivially safe" check; trades some recall on
+      paraphrased attacks for encoder load)
+    
+    Every result lists the layers that actually ran in "layers_run".
+    
+    An optional VerdictCache short-circuits repeated inputs entirely. It is
+    keyed on the raw input plus config_version(): only byte-identical
+    inputs share a verdict, and a pattern change invalidates every old
+    entry.
     """
     
-    def __init__(self):
+    def __init__(self, ml_detector=None, short_circuit=None, prefilter=None, cache=None):
         print("[*] Initializing VeilGuard Hybrid Engine...")
-        # Initialize the ML detector
-        self.ml_detector = VeilGuardML()
-        print("[+] VeilGuard Hybrid Engine ready!")
+        # Use the injected ML detector, or build one (it shares the process-wide model)
+        self.ml_detector = ml_detector if ml_detector is not None else VeilGuardML()
+        
+        # Cascade policy (explicit args win over VEILGUARD_SHORT_CIRCUIT / VEILGUARD_PREFILTER)
+        self.short_circuit = env_flag('VEILGUARD_SHORT_CIRCUIT') if short_circuit is None else short_circuit
+        self.prefilter = env_flag('VEILGUARD_PREFILTER') if prefilter is None else prefilter
+        
+        # (threat matrix, content words of its patterns) for the prefilter,
+        # recomputed when the ML patterns are hot-reloaded
+        self._prefilter_cache = None
+        
+        # Optional verdict cache (veilguard_cache.VerdictCache)
+        self.cache = cache
+        
+        print(f"[+] VeilGuard Hybrid Engine ready! "
+              f"(short_circuit={self.short_circuit}, prefilter={self.prefilter}, "
+              f"cache={'on' if self.cache is not None else 'off'})")
+    
+    @property
+    def prefilter_vocabulary(self):
+        """
+        Content words of the current ML threat patterns, used by the prefilter
+        """
+        threat_matrix = self.ml_detector.threat_matrix
+        cached = self._prefilter_cache
+        if cached is None or cached[0] is not threat_matrix:
+            vocabulary = {
+                word
+                for pattern in threat_matrix.patterns
+                for word in normalize_text(pattern).split()
+            } - PREFILTER_STOPWORDS
+            cached = (threat_matrix, vocabulary)
+            self._prefilter_cache = cached
+        return cached[1]
+    
+    def pattern_set_version(self):
+        """
+        Short id of the keyword + ML pattern sets in use (changes on every reload)
+        """
+        return hashlib.sha256(
+            f"{get_pattern_matcher().version}:{self.ml_detector.threat_matrix.version}".encode()
+        ).hexdigest()[:12]
+    
+    def config_version(self):
+        """
+        Identifies everything a verdict depends on besides the input itself
+        
+        Keyword pattern set + ML model/threat patterns + cascade policy.
+        """
+        return (f"{get_pattern_matcher().version}:{self.ml_detector.version}:"
+                f"{int(self.short_circuit)}{int(self.prefilter)}")
+    
+    def _cache_key(self, normalized):
+        if self.cache is None or not self.cache.enabled:
+            return None
+        return self.cache.make_key(self.config_version(), normalized.raw)
     
     def detect(self, user_input):
         """
         Run dual-layer threat detection
         
         Args:
-            user_input (str): The text to analyze
+            user_input (str | NormalizedInput): The text to analyze
         
         Returns:
             dict: Combined detection results with both layers' findings
         """
         
+        # Normalize once, shared by both layers
+        with timed("normalize"):
+            normalized = normalize_input(user_input)
+        
+        cache_key = self._cache_key(normalized)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        result = self._detect_normalized(normalized)
+        
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        
+        return result
+    
+    def _detect_normalized(self, normalized):
+        """
+        Uncached detect() on an already-normalized input
+        """
+        
         # Layer 1: Keyword detection (fast, catches exact matches)
-        keyword_result = keyword_detect(user_input)
+        with timed("keyword"):
+            keyword_result = keyword_detect(normalized)
+        
+        # Layer 2: ML detection (slower, catches semantic variations),
+        # unless the cascade policy says it can't change the outcome
+        skip_reason = self._ml_skip_reason(normalized, keyword_result)
+        if skip_reason:
+            with timed("merge"):
+                return self.combine(keyword_result, None, skip_reason)
+        
+        ml_result = self.ml_detector.detect(normalized.raw)
+        
+        with timed("merge"):
+            return self.combine(keyword_result, ml_result)
+    
+    def detect_many(self, user_inputs):
+        """
+        Run dual-layer detection over many inputs at once
+        
+        Keyword detection runs per input; the ML layer encodes every input
+        in one batched call and scores them with one similarity matrix.
+        
+        Args:
+            user_inputs (list): Texts (str or NormalizedInput) to analyze
+        
+        Returns:
+            list: One detect()-style result per input, in input order
+        """
+        with timed("normalize"):
+            normalized_inputs = [normalize_input(user_input) for user_input in user_inputs]
         
-        # Layer 2: ML detection (slower, catches semantic variations)
-        ml_result = self.ml_detector.detect(user_input)
+        # Serve what we can from the cache, detect the rest in one batch
+        cache_keys = [self._cache_key(normalized) for normalized in normalized_inputs]
+        results = [
+            self.cache.get(cache_key) if cache_key is not None else None
+            for cache_key in cache_keys
+        ]
+        missing = [index for index, result in enumerate(results) if result is None]
+        
+        detected = self._detect_many_normalized([normalized_inputs[index] for index in missing])
+        for index, result in zip(missing, detected):
+            results[index] = result
+            if cache_keys[index] is not None:
+                self.cache.put(cache_keys[index], result)
+        
+        return results
+    
+    def _detect_many_normalized(self, normalized_inputs):
+        """
+        Uncached detect_many() on already-normalized inputs
+        """
+        if not normalized_inputs:
+            return []
+        
+        # Layer 1: Keyword detection per input
+        with timed("keyword"):
+            keyword_results = [keyword_detect(normalized) for normalized in normalized_inputs]
+        
+        # Layer 2: One batched ML pass for the inputs the cascade doesn't skip
+        skip_reasons = [
+            self._ml_skip_reason(normalized, keyword_result)
+            for normalized, keyword_result in zip(normalized_inputs, keyword_results)
+        ]
+        ml_results = iter(self.ml_detector.detect_many([
+            normalized.raw
+            for normalized, skip_reason in zip(normalized_inputs, skip_reasons)
+            if not skip_reason
+        ]))
+        
+        with timed("merge"):
+            return [
+                self.combine(keyword_result, None if skip_reason else next(ml_results), skip_reason)
+                for keyword_result, skip_reason in zip(keyword_results, skip_reasons)
+            ]
+    
+    async def detect_async(self, user_input, ml_batcher):
+        """
+        Same as detect(), but the ML layer goes through a MicroBatcher
+        
+        Concurrent callers awaiting this share batched encoder passes
+        instead of running one forward pass each.
+        
+        Args:
+            user_input (str | NormalizedInput): The text to analyze
+            ml_batcher (MicroBatcher): Batcher wrapping ml_detector.detect_many
+        
+        Returns:
+            dict: Combined detection results, same shape as detect()
+        """
+        with timed("normalize"):
+            normalized = normalize_input(user_input)
+        
+        cache_key = self._cache_key(normalized)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+        
+        # Layer 1 is cheap enough to run inline
+        with timed("keyword"):
+            keyword_result = keyword_detect(normalized)
+        
+        skip_reason = self._ml_skip_reason(normalized, keyword_result)
+        if skip_reason:
+            ml_result = None
+        else:
+            # Layer 2 waits for its slot in the next encoder batch
+            # ("ml_wait" = queueing + the shared batch's encode/similarity)
+            with timed("ml_wait"):
+                ml_result = await ml_batcher.submit(normalized.raw)
+        
+        with timed("merge"):
+            result = self.combine(keyword_result, ml_result, skip_reason)
+        
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        
+        return result
+    
+    def _ml_skip_reason(self, normalized, keyword_result):
+        """
+        Decide whether the ML layer can be skipped for this input
+        
+        Returns:
+            str: "keyword_short_circuit" or "prefilter", or None to run ML
+        """
+        if self.short_circuit and keyword_result["risk_level"] == "HIGH":
+            return "keyword_short_circuit"
+        if self.prefilter and not self.prefilter_vocabulary.intersection(normalized.text.split()):
+            return "prefilter"
+        return None
+    
+    def combine(self, keyword_result, ml_result, ml_skipped=None):
+        """
+        Merge the keyword and ML layer results into one verdict
+        
+        Args:
+            keyword_result (dict): Result of the keyword layer
+            ml_result (dict): Result of the ML layer, or None if it was skipped
+            ml_skipped (str): Why the ML layer was skipped (when ml_result is None)
+        
+        Returns:
+            dict: Combined detection results with both layers' findings
+        """
+        
+        layers_run = ["keyword"]
+        if ml_result is None:
+            # ML didn't run: it contributes nothing to the verdict
+            ml_result = {
+                "blocked": False,
+                "risk_level": "NONE",
+                "similarity_score": 0.0,
+                "matched_pattern": None,
+                "top_matches": []
+            }
+        else:
+            layers_run.append("ml_semantic")
         
         # Determine overall threat status
         # Block if EITHER detector flags it
@@ -77,6 +334,9 @@ class VeilGuardHybrid:
             "detection_method": detection_method,
             "patterns_found": all_patterns if all_patterns else [],
             "ml_similarity_score": ml_result.get("similarity_score"),
+            "ml_top_matches": ml_result.get("top_matches", []),
+            "layers_run": layers_run,
+            "pattern_set_version": self.pattern_set_version(),
             "layers": {
                 "keyword": {
                     "detected": keyword_result["blocked"],
@@ -86,7 +346,8 @@ class VeilGuardHybrid:
                 "ml_semantic": {
                     "detected": ml_result["blocked"],
                     "risk": ml_result["risk_level"],
-                    "score": ml_result["similarity_score"]
+                    "score": ml_result["similarity_score"],
+                    "skipped": ml_skipped
                 }
             }
         }
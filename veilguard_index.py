@@ -0,0 +1,307 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from veilguard_ml import l2_normalize
+
+# Probed lists per query unless overridden (VEILGUARD_ANN_NPROBE)
+DEFAULT_NPROBE = 8
+
+# k-means settings used when building an index
+DEFAULT_ITERATIONS = 10
+TRAIN_POINTS_PER_LIST = 64
+ASSIGN_CHUNK_ROWS = 4096
+
+INDEX_META_FILE = "index.json"
+INDEX_ARRAYS = ("centroids", "vectors", "offsets", "ids")
+
+def default_list_count(count):
+    """
+    Number of inverted lists for a corpus size (~4 * sqrt(N), at least 1)
+    """
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+def _assign(vectors, centroids):
+    """
+    Index of the closest centroid for each (normalized) vector
+    """
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK_ROWS], dtype=np.float32)
+        assignments[start:start + len(chunk)] = (chunk @ centroids.T).argmax(axis=1)
+    return assignments
+
+def _kmeans(vectors, n_lists, iterations, rng):
+    """
+    Spherical k-means: centroids are kept unit length, so the closest
+    centroid by dot product is also the closest by cosine similarity
+    """
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    
+    for _ in range(iterations):
+        assignments = _assign(vectors, centroids)
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=n_lists)
+        
+        # Sum each cluster's members in one pass over the sorted vectors
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+        centroids[filled] = l2_normalize(np.add.reduceat(vectors[order], starts, axis=0))
+        
+        # Re-seed empty lists with random points so every list stays useful
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    
+    return centroids
+
+class IVFIndex:
+    """
+    VeilGuard ANN Index
+    Inverted-file (IVF-Flat) nearest-neighbour index for large threat corpora
+    
+    Threat embeddings are clustered with k-means into n_lists inverted
+    lists. A query is compared against the list centroids and only the
+    vectors of its nprobe closest lists are scored, so the cost per query
+    grows with nprobe * N / n_lists instead of N.
+    
+    nprobe is the recall-vs-latency knob: nprobe = n_lists is exact search,
+    lower values trade recall for speed. See benchmarks/ann.py.
+    
+    Vectors are stored sorted by list in one contiguous array, so each
+    probed list is a slice (no gather). Everything is plain numpy arrays,
+    saved as .npy files and memory-mapped on load.
+    """
+    
+    def __init__(self, patterns, centroids, vectors, offsets, ids, meta=None, nprobe=None):
+        self.patterns = patterns
+        self.centroids = centroids
+        self.vectors = vectors
+        self.offsets = offsets
+        self.ids = ids
+        self.meta = meta or {}
+        self.n_lists = len(centroids)
+        self.nprobe = max(1, int(nprobe or os.getenv('VEILGUARD_ANN_NPROBE') or DEFAULT_NPROBE))
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    @property
+    def version(self):
+        """
+        Identifies the indexed corpus + model (e.g. for cache keys)
+        """
+        return self.meta.get("content_hash", "")
+    
+    @classmethod
+    def build(cls, patterns, embeddings, n_lists=None, iterations=DEFAULT_ITERATIONS,
+              dtype="float32", seed=0, model_name=None):
+        """
+        Build an index from threat patterns and their embeddings
+        
+        Args:
+            patterns (list): Threat pattern strings
+            embeddings (np.ndarray): One embedding row per pattern
+            n_lists (int): Inverted lists (default ~4 * sqrt(N))
+            iterations (int): k-means iterations
+            dtype (str): Vector storage type, float32 or float16
+            seed (int): Random seed for k-means initialisation
+            model_name (str): Model the embeddings came from (stored in the metadata)
+        """
+        vectors = l2_normalize(embeddings)
+        if len(vectors) != len(patterns):
+            raise ValueError(f"Got {len(vectors)} embeddings for {len(patterns)} patterns")
+        if not len(vectors):
+            raise ValueError("Cannot build an index from an empty corpus")
+        
+        n_lists = max(1, min(len(vectors), int(n_lists or default_list_count(len(vectors)))))
+        rng = np.random.default_rng(seed)
+        
+        # Train on a sample, then assign the whole corpus
+        sample_size = min(len(vectors), n_lists * TRAIN_POINTS_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = _kmeans(sample, n_lists, iterations, rng)
+        
+        assignments = _assign(vectors, centroids)
+        ids = np.argsort(assignments, kind="stable")
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=n_lists))))
+        
+        meta = {
+            "model_name": model_name,
+            "count": len(patterns),
+            "dimension": int(vectors.shape[1]),
+            "n_lists": n_lists,
+            "dtype": np.dtype(dtype).name,
+            "content_hash": hashlib.sha256(
+                '\n'.join([model_name or ""] + list(patterns)).encode()
+            ).hexdigest()[:16]
+        }
+        return cls(
+            list(patterns), centroids.astype(np.float32),
+            np.ascontiguousarray(vectors[ids], dtype=dtype), offsets.astype(np.int64), ids, meta
+        )
+    
+    def save(self, directory):
+        """
+        Write the index to a directory (.npy arrays + patterns + index.json)
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in INDEX_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "patterns.json"), "w") as f:
+            json.dump(self.patterns, f)
+        with open(os.path.join(directory, INDEX_META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=2)
+    
+    @classmethod
+    def load(cls, directory, nprobe=None, mmap=True):
+        """
+        Load an index saved with save()
+        
+        With mmap (the default) the arrays are memory-mapped read-only, so
+        startup doesn't read the corpus into memory and every process
+        loading the same index shares the page cache.
+        """
+        with open(os.path.join(directory, INDEX_META_FILE)) as f:
+            meta = json.load(f)
+        with open(os.path.join(directory, "patterns.json")) as f:
+            patterns = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in INDEX_ARRAYS
+        }
+        # Centroids are scored for every query: keep them in RAM
+        arrays["centroids"] = np.array(arrays["centroids"], dtype=np.float32)
+        return cls(patterns, meta=meta, nprobe=nprobe, **arrays)
+    
+    def top_k(self, queries, k, nprobe=None):
+        """
+        The approximately k most similar patterns for each query, best first
+        
+        Same contract as ThreatMatrix.top_k(). Rows with fewer than k
+        candidates in their probed lists are padded with index -1 and
+        score -inf.
+        
+        Args:
+            queries (np.ndarray): Query embeddings (normalized here)
+            k (int): Matches per query
+            nprobe (int): Lists to probe (default self.nprobe)
+        
+        Returns:
+            tuple: (indices, scores), both (queries x k), best match first
+        """
+        queries = l2_normalize(queries)
+        nprobe = max(1, min(self.n_lists, int(nprobe or self.nprobe)))
+        
+        coarse = queries @ self.centroids.T
+        if nprobe < self.n_lists:
+            probes = np.argpartition(coarse, self.n_lists - nprobe, axis=1)[:, self.n_lists - nprobe:]
+        else:
+            probes = np.broadcast_to(np.arange(self.n_lists), coarse.shape)
+        
+        top_indices = np.full((len(queries), k), -1, dtype=np.int64)
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        
+        for row, query in enumerate(queries):
+            scores = []
+            ids = []
+            for list_id in probes[row]:
+                start, end = self.offsets[list_id], self.offsets[list_id + 1]
+                if start == end:
+                    continue
+                scores.append(self.vectors[start:end] @ query)
+                ids.append(self.ids[start:end])
+            if not scores:
+                continue
+            
+            scores = np.concatenate(scores).astype(np.float32, copy=False)
+            ids = np.concatenate(ids)
+            found = min(k, len(scores))
+            best = np.argpartition(scores, len(scores) - found)[len(scores) - found:]
+            best = best[np.argsort(scores[best])[::-1]]
+            top_indices[row, :found] = ids[best]
+            top_scores[row, :found] = scores[best]
+        
+        return top_indices, top_scores
+    
+    def stats(self):
+        sizes = np.diff(self.offsets)
+        return {
+            "patterns": len(self),
+            "n_lists": self.n_lists,
+            "nprobe": self.nprobe,
+            "dtype": self.vectors.dtype.name,
+            "mean_list_size": round(float(sizes.mean()), 1),
+            "max_list_size": int(sizes.max()),
+            "model_name": self.meta.get("model_name")
+        }
+
+def read_corpus(path):
+    """
+    Read threat prompts from a file
+    
+    .jsonl files: one JSON object per line, text in "text", "prompt" or
+    "pattern" (or a bare JSON string). Anything else: one prompt per line.
+    Blank lines and duplicates are dropped, order is kept.
+    """
+    patterns = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                if isinstance(record, dict):
+                    record = record.get("text") or record.get("prompt") or record.get("pattern")
+                if not record:
+                    continue
+                line = str(record)
+            patterns.append(line)
+    return list(dict.fromkeys(patterns))
+
+def build_index(corpus_path, output_dir, model_name=None, backend=None, n_lists=None,
+                dtype="float32", batch_size=256):
+    """
+    Encode a threat corpus with the configured model and save an IVF index
+    
+    Returns:
+        IVFIndex: The built index
+    """
+    from veilguard_models import get_encoder, get_model_name
+    
+    model_name = get_model_name(model_name)
+    patterns = read_corpus(corpus_path)
+    print(f"[*] Encoding {len(patterns)} threat patterns with '{model_name}'...")
+    
+    encoder = get_encoder(model_name, backend)
+    started = time.perf_counter()
+    embeddings = np.concatenate([
+        np.asarray(encoder.encode(patterns[start:start + batch_size]), dtype=np.float32)
+        for start in range(0, len(patterns), batch_size)
+    ])
+    print(f"[+] Encoded in {time.perf_counter() - started:.1f}s")
+    
+    started = time.perf_counter()
+    index = IVFIndex.build(patterns, embeddings, n_lists=n_lists, dtype=dtype, model_name=model_name)
+    index.save(output_dir)
+    print(f"[+] Built {index.n_lists}-list index in {time.perf_counter() - started:.1f}s -> {output_dir}")
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a VeilGuard ANN threat index")
+    parser.add_argument("corpus", help="Threat prompts: .txt (one per line) or .jsonl")
+    parser.add_argument("output", help="Directory to write the index to")
+    parser.add_argument("--model", help="Model name or path (default: VEILGUARD_MODEL)")
+    parser.add_argument("--backend", help="Encoder backend (default: VEILGUARD_ENCODER_BACKEND)")
+    parser.add_argument("--lists", type=int, help="Inverted lists (default ~4*sqrt(N))")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    args = parser.parse_args()
+    
+    built = build_index(args.corpus, args.output, args.model, args.backend, args.lists, args.dtype)
+    print(json.dumps(built.stats(), indent=2))
@@ -0,0 +1,370 @@
+import bisect
+import contextvars
+import threading
+import time
+
+from veilguard import env_flag
+
+# Instrumentation on/off (VEILGUARD_METRICS, default on) and the optional
+# per-response Server-Timing header (VEILGUARD_SERVER_TIMING, default off)
+METRICS_ENABLED = env_flag('VEILGUARD_METRICS', True)
+SERVER_TIMING = env_flag('VEILGUARD_SERVER_TIMING', False)
+
+# Latency buckets in seconds: 50 us (keyword scan) up to 10 s (huge batches)
+DEFAULT_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """
+    Prometheus-style histogram with fixed buckets
+    
+    observe() is a bisect plus three increments under an uncontended lock,
+    cheap enough to leave on for every request.
+    """
+    
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in sorted(snapshot):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+class Counter:
+    """
+    Monotonic counter, optionally labelled
+    """
+    
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class CallbackMetric:
+    """
+    Gauge (or counter) read at scrape time from a callback, so it costs nothing per request
+    
+    The callback returns a number, None (metric skipped) or a dict mapping
+    label-value tuples to numbers.
+    """
+    
+    def __init__(self, name, help_text, callback, labelnames=(), kind="gauge"):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.labelnames = tuple(labelnames)
+        self.kind = kind
+    
+    def render(self):
+        try:
+            values = self.callback()
+        except Exception:
+            # A broken source (e.g. torn-down pool) must not break the whole scrape
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+class Registry:
+    """
+    The process's metrics, rendered together in the Prometheus text format
+    """
+    
+    def __init__(self):
+        self._metrics = {}
+    
+    def histogram(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._metrics.setdefault(name, Histogram(name, help_text, labelnames, buckets))
+    
+    def counter(self, name, help_text, labelnames=()):
+        return self._metrics.setdefault(name, Counter(name, help_text, labelnames))
+    
+    def gauge(self, name, help_text, callback, labelnames=(), kind="gauge"):
+        """
+        Register (or replace) a callback metric
+        """
+        self._metrics[name] = CallbackMetric(name, help_text, callback, labelnames, kind)
+        return self._metrics[name]
+    
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "veilguard_stage_seconds",
+    "Time per detection stage call (a batched call is observed once)",
+    ["stage"]
+)
+CHECK_SECONDS = REGISTRY.histogram(
+    "veilguard_check_seconds",
+    "Single-input check latency by detection_method",
+    ["endpoint", "detection_method"]
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "veilguard_http_request_seconds",
+    "HTTP request duration, request start to last response byte",
+    ["path", "status"]
+)
+VERDICTS = REGISTRY.counter(
+    "veilguard_verdicts_total",
+    "Verdicts returned, by endpoint, detection_method and blocked",
+    ["endpoint", "detection_method", "blocked"]
+)
+ENCODE_TOKENS = REGISTRY.counter(
+    "veilguard_encode_tokens_total",
+    "Token slots fed to the encoder: real tokens and padding",
+    ["kind"]
+)
+ENCODE_TRUNCATED = REGISTRY.counter(
+    "veilguard_encode_truncated_total",
+    "Inputs longer than the encoder's token window (cut before encoding)"
+)
+PADDING_RATIO = REGISTRY.histogram(
+    "veilguard_encode_padding_ratio",
+    "Share of padding in the token matrix of each encoder call",
+    buckets=(0.01, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9)
+)
+
+# Stage timings of the request being handled (None outside a request)
+_request_timings = contextvars.ContextVar("veilguard_request_timings", default=None)
+
+def observe_stage(stage, seconds):
+    """
+    Record one stage duration in the histogram and the current request's timings
+    """
+    if not METRICS_ENABLED:
+        return
+    STAGE_SECONDS.observe(seconds, (stage,))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+def observe_tokens(real_tokens, padded_tokens, truncated=0):
+    """
+    Record one encoder call's token counts (padded = real + padding slots)
+    
+    The current request's totals are rendered as a padding ratio in
+    Server-Timing.
+    """
+    if not METRICS_ENABLED or not padded_tokens:
+        return
+    ENCODE_TOKENS.inc(("real",), real_tokens)
+    ENCODE_TOKENS.inc(("padding",), padded_tokens - real_tokens)
+    if truncated:
+        ENCODE_TRUNCATED.inc((), truncated)
+    PADDING_RATIO.observe(1 - real_tokens / padded_tokens)
+    timings = _request_timings.get()
+    if timings is not None:
+        totals = timings.setdefault("_tokens", [0, 0])
+        totals[0] += real_tokens
+        totals[1] += padded_tokens
+
+def current_timings():
+    """
+    The stage timings dict of the request being handled, or None
+    """
+    return _request_timings.get()
+
+def merge_timings(timings, into):
+    """
+    Add one timings dict (e.g. a shared encoder batch's) to a request's timings
+    """
+    if into is None:
+        return
+    for stage, value in timings.items():
+        if stage == "_tokens":
+            totals = into.setdefault("_tokens", [0, 0])
+            totals[0] += value[0]
+            totals[1] += value[1]
+        elif not stage.startswith("_"):
+            into[stage] = into.get(stage, 0.0) + value
+
+class collect_timings:
+    """
+    Context manager recording stages into a fresh timings dict instead of
+    the current request's: with collect_timings() as batch_timings: ...
+    """
+    
+    __slots__ = ('timings', 'token')
+    
+    def __enter__(self):
+        self.timings = {}
+        self.token = _request_timings.set(self.timings)
+        return self.timings
+    
+    def __exit__(self, *exc_info):
+        _request_timings.reset(self.token)
+        return False
+
+class timed:
+    """
+    Context manager timing a stage: with timed("keyword"): ...
+    """
+    
+    __slots__ = ('stage', 'started')
+    
+    def __init__(self, stage):
+        self.stage = stage
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc_info):
+        observe_stage(self.stage, time.perf_counter() - self.started)
+        return False
+
+def record_verdicts(endpoint, results, seconds=None):
+    """
+    Count verdicts by detection_method; with seconds, also observe single-check latency
+    
+    Marks the end of the handler, so the middleware can time response
+    serialization separately.
+    """
+    if not METRICS_ENABLED:
+        return
+    for result in results:
+        method = result.get("detection_method", "none")
+        VERDICTS.inc((endpoint, method, str(result.get("blocked", False)).lower()))
+        if seconds is not None:
+            CHECK_SECONDS.observe(seconds, (endpoint, method))
+    timings = _request_timings.get()
+    if timings is not None:
+        timings["_handler_done"] = time.perf_counter()
+
+def server_timing_header(timings):
+    """
+    Server-Timing value for the stage timings of one request
+    """
+    entries = [
+        f"{stage};dur={seconds * 1000:.3f}"
+        for stage, seconds in timings.items() if not stage.startswith("_")
+    ]
+    tokens = timings.get("_tokens")
+    if tokens and tokens[1]:
+        entries.append(f'padding;desc="{1 - tokens[0] / tokens[1]:.3f}"')
+    return ", ".join(entries)
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: per-request stage timings, request histogram, Server-Timing
+    
+    Sets up the request's timing dict (filled by timed() / observe_stage()
+    anywhere in the request's context), times serialization from the
+    handler's record_verdicts() call to the response start, and observes the
+    whole request. With VEILGUARD_SERVER_TIMING=1 the timings are sent back
+    as a Server-Timing header (visible in browser dev tools).
+    
+    Plain ASGI rather than BaseHTTPMiddleware, so streamed request and
+    response bodies pass straight through.
+    """
+    
+    def __init__(self, app, server_timing=None):
+        self.app = app
+        self.server_timing = SERVER_TIMING if server_timing is None else server_timing
+        self._paths = None
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+        
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                now = time.perf_counter()
+                handler_done = timings.pop("_handler_done", None)
+                if handler_done is not None:
+                    observe_stage("serialize", now - handler_done)
+                timings["total"] = now - started
+                if self.server_timing:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", server_timing_header(timings).encode()))
+                    message = dict(message, headers=headers)
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            HTTP_SECONDS.observe(time.perf_counter() - started, (self._path_label(scope), str(status)))
+    
+    def _path_label(self, scope):
+        """
+        The route path, or "other" (unknown paths would blow up the label cardinality)
+        """
+        if self._paths is None and "app" in scope:
+            self._paths = {getattr(route, "path", None) for route in scope["app"].routes}
+        path = scope.get("path", "")
+        return path if self._paths and path in self._paths else "other"
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Default sentence-transformer used by the semantic layer (~80MB)
+DEFAULT_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Where threat-embedding artifacts are read from / written to
+DEFAULT_ARTIFACT_DIR = "artifacts"
+
+# Process-wide registry: one encoder per (model, backend), one embedding
+# matrix per (model, backend, pattern list). Every detector pulls from here,
+# so a worker only ever holds one copy of the weights and of the threat
+# embeddings.
+_lock = threading.Lock()
+_encoders = {}
+_threat_embeddings = {}
+_embedding_caches = {}
+
+# How each threat-embedding matrix was obtained (artifact or encoded), for /health
+_threat_embedding_info = {}
+
+def get_model_name(model_name=None):
+    """
+    Resolve the model name (explicit > VEILGUARD_MODEL env var > default)
+    """
+    return model_name or os.getenv('VEILGUARD_MODEL') or DEFAULT_MODEL_NAME
+
+def get_backend(backend=None):
+    """
+    Resolve the encoder backend (explicit > VEILGUARD_ENCODER_BACKEND env var > torch)
+    """
+    from veilguard_encoders import DEFAULT_BACKEND
+    
+    return backend or os.getenv('VEILGUARD_ENCODER_BACKEND') or DEFAULT_BACKEND
+
+def get_encoder(model_name=None, backend=None):
+    """
+    Get the shared encoder for a model, loading it on first use
+    
+    Args:
+        model_name (str): Model name or local path. Defaults to VEILGUARD_MODEL
+                          or all-MiniLM-L6-v2
+        backend (str): torch, onnx or onnx-int8. Defaults to
+                       VEILGUARD_ENCODER_BACKEND or torch
+    
+    With VEILGUARD_ENCODER_SERVER set, returns a RemoteEncoder talking to a
+    shared inference server instead of loading the model here; with
+    VEILGUARD_ENCODER_WORKERS set, returns an EncoderPool of forked workers.
+    
+    Returns:
+        TorchEncoder | OnnxEncoder | EncoderPool | RemoteEncoder: The
+        process-wide instance for that model
+    """
+    # Imported lazily so the keyword-only paths don't pay for numpy/torch
+    from veilguard_encoders import create_encoder
+    
+    key = (get_model_name(model_name), get_backend(backend))
+    
+    with _lock:
+        encoder = _encoders.get(key)
+        if encoder is None:
+            server = os.getenv('VEILGUARD_ENCODER_SERVER')
+            if server:
+                from veilguard_workers import RemoteEncoder
+                print(f"[*] Connecting to encoder server at {server}...")
+                encoder = RemoteEncoder(server, *key)
+            elif os.getenv('VEILGUARD_ENCODER_WORKERS'):
+                from veilguard_workers import EncoderPool
+                print(f"[*] Starting encoder pool for '{key[0]}' ({key[1]} backend)...")
+                encoder = EncoderPool(*key)
+            else:
+                print(f"[*] Loading encoder model '{key[0]}' ({key[1]} backend)...")
+                encoder = create_encoder(*key)
+            _encoders[key] = encoder
+    
+    return encoder
+
+def get_artifact_dir():
+    """
+    Directory for threat-embedding artifacts (VEILGUARD_ARTIFACT_DIR, default ./artifacts)
+    """
+    return os.getenv('VEILGUARD_ARTIFACT_DIR') or DEFAULT_ARTIFACT_DIR
+
+def threat_content_hash(patterns, model_name, backend):
+    """
+    Identifies a pattern list encoded with a given model + backend
+    """
+    return hashlib.sha256(
+        '\n'.join([model_name, backend] + list(patterns)).encode()
+    ).hexdigest()[:16]
+
+def _artifact_paths(content_hash, directory=None):
+    base = os.path.join(directory or get_artifact_dir(), f"threats-{content_hash}")
+    return base + ".npy", base + ".json"
+
+def load_threat_artifact(patterns, model_name, backend, directory=None):
+    """
+    Load prebuilt threat embeddings for exactly these patterns + model + backend
+    
+    The artifact is memory-mapped; the manifest must match the pattern
+    list and model, otherwise it is ignored.
+    
+    Returns:
+        np.ndarray | None: The embeddings, or None if there is no valid artifact
+    """
+    import numpy as np
+    
+    content_hash = threat_content_hash(patterns, model_name, backend)
+    array_path, manifest_path = _artifact_paths(content_hash, directory)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (manifest.get("content_hash") != content_hash
+                or manifest.get("model_name") != model_name
+                or manifest.get("backend") != backend
+                or manifest.get("patterns") != list(patterns)):
+            print(f"[!] Ignoring stale threat-embedding artifact {manifest_path}")
+            return None
+        embeddings = np.load(array_path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print(f"[!] Could not read threat-embedding artifact {array_path}: {e}")
+        return None
+    
+    if embeddings.shape[0] != len(patterns):
+        print(f"[!] Ignoring truncated threat-embedding artifact {array_path}")
+        return None
+    return embeddings
+
+def save_threat_artifact(patterns, embeddings, model_name, backend, directory=None):
+    """
+    Write threat embeddings + manifest (patterns, model, content hash)
+    
+    Files are written under a temporary name and renamed into place, so a
+    concurrently starting worker never reads a half-written artifact.
+    
+    Returns:
+        str: Path of the .npy file
+    """
+    import numpy as np
+    
+    content_hash = threat_content_hash(patterns, model_name, backend)
+    array_path, manifest_path = _artifact_paths(content_hash, directory)
+    os.makedirs(os.path.dirname(array_path) or ".", exist_ok=True)
+    
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    manifest = {
+        "content_hash": content_hash,
+        "model_name": model_name,
+        "backend": backend,
+        "count": len(patterns),
+        "dimension": int(embeddings.shape[1]),
+        "dtype": "float32",
+        "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "patterns": list(patterns)
+    }
+    
+    suffix = f".tmp{os.getpid()}"
+    with open(array_path + suffix, "wb") as f:
+        np.save(f, embeddings)
+    with open(manifest_path + suffix, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(array_path + suffix, array_path)
+    os.replace(manifest_path + suffix, manifest_path)
+    return array_path
+
+def get_threat_embeddings(patterns, model_name=None, backend=None):
+    """
+    Get the shared embedding matrix for a list of threat patterns
+    
+    Loaded from a prebuilt artifact when one matches the patterns, model
+    and backend (see `python -m veilguard_models build`); otherwise encoded
+    and written back as an artifact so the next start skips encoding.
+    Either way this happens once per (model, backend, patterns) per process.
+    
+    Returns:
+        np.ndarray: One float32 embedding row per pattern
+    """
+    model_name, backend = get_model_name(model_name), get_backend(backend)
+    key = (model_name, backend, tuple(patterns))
+    
+    embeddings = _threat_embeddings.get(key)
+    if embeddings is None:
+        started = time.perf_counter()
+        embeddings = load_threat_artifact(patterns, model_name, backend)
+        source = "artifact"
+        
+        if embeddings is None:
+            encoder = get_encoder(model_name, backend)
+            with _lock:
+                embeddings = _threat_embeddings.get(key)
+                if embeddings is not None:
+                    return embeddings
+                print("[*] Generating threat embeddings...")
+                embeddings = encoder.encode(list(patterns))
+            source = "encoded"
+            try:
+                save_threat_artifact(patterns, embeddings, model_name, backend)
+            except OSError as e:
+                # e.g. read-only filesystem: still serve, just encode again next start
+                print(f"[!] Could not write threat-embedding artifact: {e}")
+        else:
+            print(f"[+] Loaded {len(patterns)} threat embeddings from artifact")
+        
+        with _lock:
+            embeddings = _threat_embeddings.setdefault(key, embeddings)
+            _threat_embedding_info[key] = {
+                "content_hash": threat_content_hash(patterns, model_name, backend),
+                "source": source,
+                "patterns": len(patterns),
+                "seconds": round(time.perf_counter() - started, 3)
+            }
+    
+    return embeddings
+
+def threat_embedding_info():
+    """
+    How each loaded threat-embedding matrix was obtained (for /health)
+    """
+    return [
+        {"model_name": model_name, "backend": backend, **info}
+        for (model_name, backend, _), info in _threat_embedding_info.items()
+    ]
+
+def get_embedding_cache(model_name=None, backend=None):
+    """
+    Get the shared input-embedding cache for a model
+    
+    One cache per (model, backend) per process, so every detector using
+    that encoder (hybrid, ML-only, comparison) reuses the same cached
+    embeddings. Budget/dtype from VEILGUARD_EMBEDDING_CACHE_MB /
+    VEILGUARD_EMBEDDING_CACHE_DTYPE.
+    """
+    from veilguard_cache import EmbeddingCache
+    
+    key = (get_model_name(model_name), get_backend(backend))
+    with _lock:
+        cache = _embedding_caches.get(key)
+        if cache is None:
+            cache = EmbeddingCache()
+            _embedding_caches[key] = cache
+    
+    return cache
+
+def process_uptime_seconds():
+    """
+    Seconds since this process started (None if /proc is unavailable)
+    
+    Includes interpreter start and imports, which a timer started inside
+    the app would miss.
+    """
+    try:
+        with open('/proc/self/stat') as stat:
+            # Field 22 (starttime, in clock ticks since boot); split after the
+            # parenthesised command name, which may contain spaces
+            start_ticks = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            system_uptime = float(uptime.read().split()[0])
+        return round(system_uptime - start_ticks / os.sysconf('SC_CLK_TCK'), 2)
+    except (OSError, ValueError, IndexError):
+        return None
+
+def process_memory_mb():
+    """
+    Current resident memory of this process in MB (peak RSS if /proc is unavailable)
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return round(resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # ru_maxrss is KB on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 * 1024 if os.uname().sysname == 'Darwin' else 1024
+        return round(peak / divisor, 1)
+
+# Build step: python -m veilguard_models build
+if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Prebuild VeilGuard threat-embedding artifacts")
+    parser.add_argument("command", choices=["build"])
+    parser.add_argument("--model", help="Model name or path (default: VEILGUARD_MODEL)")
+    parser.add_argument("--backend", help="Encoder backend (default: VEILGUARD_ENCODER_BACKEND)")
+    parser.add_argument("--output", help=f"Artifact directory (default: VEILGUARD_ARTIFACT_DIR or {DEFAULT_ARTIFACT_DIR})")
+    args = parser.parse_args()
+    
+    from veilguard_ml import MALICIOUS_PATTERNS
+    
+    model_name, backend = get_model_name(args.model), get_backend(args.backend)
+    started = time.perf_counter()
+    encoded = get_encoder(model_name, backend).encode(list(MALICIOUS_PATTERNS))
+    path = save_threat_artifact(MALICIOUS_PATTERNS, encoded, model_name, backend, args.output)
+    print(f"[+] Wrote {len(MALICIOUS_PATTERNS)} threat embeddings to {path} "
+          f"({time.perf_counter() - started:.1f}s)")
@@ -0,0 +1,240 @@
+import asyncio
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from veilguard import set_danger_patterns
+
+# How often the pattern file is checked for changes (VEILGUARD_PATTERNS_WATCH_SECONDS)
+DEFAULT_WATCH_SECONDS = 5.0
+
+def get_pattern_file():
+    """
+    Path of the hot-reloadable pattern file (VEILGUARD_PATTERNS_FILE), or None
+    """
+    return os.getenv('VEILGUARD_PATTERNS_FILE') or None
+
+def read_pattern_file(path=None):
+    """
+    Read keyword and ML threat patterns from a JSON file
+    
+    Format: {"keyword_patterns": [...], "ml_patterns": [...]}. Either key
+    may be left out, in which case that layer keeps its current patterns.
+    
+    Returns:
+        dict: keyword_patterns / ml_patterns (None when absent); empty if no file is configured
+    """
+    path = path or get_pattern_file()
+    if not path:
+        return {}
+    
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected a JSON object with keyword_patterns / ml_patterns")
+    
+    patterns = {}
+    for key in ("keyword_patterns", "ml_patterns"):
+        value = data.get(key)
+        if value is not None and not (isinstance(value, list) and all(isinstance(p, str) for p in value)):
+            raise ValueError(f"{path}: {key} must be a list of strings")
+        patterns[key] = value
+    return patterns
+
+def write_pattern_file(path, keyword_patterns=None, ml_patterns=None):
+    """
+    Atomically replace the pattern file (None keeps that key's current value)
+    
+    The new content goes to a temporary file in the same directory, which
+    is then renamed over the old one, so a watcher never reads half a file.
+    """
+    try:
+        patterns = read_pattern_file(path)
+    except FileNotFoundError:
+        patterns = {}
+    if keyword_patterns is not None:
+        patterns["keyword_patterns"] = keyword_patterns
+    if ml_patterns is not None:
+        patterns["ml_patterns"] = ml_patterns
+    data = {key: value for key, value in patterns.items() if value is not None}
+    
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=".patterns-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+class PatternReloader:
+    """
+    VeilGuard Pattern Reloader
+    Hot-swaps keyword and ML threat patterns without a restart
+    
+    Both layers build their new state on the side (Aho-Corasick automaton,
+    ThreatMatrix with only the added ML patterns encoded) and swap it in
+    with one assignment, so requests keep flowing on the old patterns until
+    the new ones are complete. Old verdict-cache entries stop matching
+    because the cache key includes the pattern versions.
+    
+    Reloads are triggered by the admin endpoint or by the file watcher,
+    which polls VEILGUARD_PATTERNS_FILE every VEILGUARD_PATTERNS_WATCH_SECONDS
+    (0 disables it). Each uvicorn worker has its own reloader, so publish()
+    writes admin changes to the pattern file for every worker's watcher to
+    pick up; without a pattern file only the calling process changes. One reload runs at a time, on the reloader's own
+    thread rather than the inference executor: encoding a large pattern
+    list never queues ahead of /check jobs, only the final swap touches
+    what they read.
+    """
+    
+    def __init__(self, detector, path=None, interval=None):
+        self.detector = detector
+        self.path = path or get_pattern_file()
+        self.interval = float(
+            interval if interval is not None
+            else os.getenv('VEILGUARD_PATTERNS_WATCH_SECONDS') or DEFAULT_WATCH_SECONDS
+        )
+        
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="veilguard-reload")
+        self._watcher = None
+        self._file_state = self._stat()
+        
+        self.reloads = 0
+        self.last_reload = None
+        self.last_error = None
+    
+    def reload(self, keyword_patterns=None, ml_patterns=None, source="api"):
+        """
+        Swap in new keyword and/or ML patterns (None leaves a layer unchanged)
+        
+        Runs the ML encoding in the calling thread; call it off the event loop.
+        
+        Returns:
+            dict: What changed, the new pattern_set_version and how long it took
+        """
+        if keyword_patterns is None and ml_patterns is None:
+            raise ValueError("Nothing to reload: give keyword_patterns and/or ml_patterns")
+        
+        with self._lock:
+            started = time.perf_counter()
+            summary = {"source": source, "pid": os.getpid()}
+            
+            # Validate the keyword list before the ML swap, so a bad request
+            # never leaves one layer switched and the other not
+            if keyword_patterns is not None and not any(pattern.strip() for pattern in keyword_patterns):
+                raise ValueError("Keyword pattern list cannot be empty")
+            if ml_patterns is not None:
+                summary["ml"] = self.detector.ml_detector.set_patterns(ml_patterns)
+            if keyword_patterns is not None:
+                matcher = set_danger_patterns(keyword_patterns)
+                summary["keyword"] = {"keyword_patterns": len(matcher.patterns)}
+            
+            summary["pattern_set_version"] = self.detector.pattern_set_version()
+            summary["seconds"] = round(time.perf_counter() - started, 3)
+            
+            self.reloads += 1
+            self.last_reload = summary
+            self.last_error = None
+            print(f"[+] Patterns reloaded from {source} "
+                  f"(pattern set {summary['pattern_set_version']}, {summary['seconds']}s)")
+            return summary
+    
+    def reload_from_file(self):
+        """
+        Reload whatever the pattern file contains
+        """
+        if not self.path:
+            raise ValueError("No pattern file configured (set VEILGUARD_PATTERNS_FILE)")
+        self._file_state = self._stat()
+        patterns = read_pattern_file(self.path)
+        return self.reload(patterns.get("keyword_patterns"), patterns.get("ml_patterns"), source="file")
+    
+    def publish(self, keyword_patterns=None, ml_patterns=None):
+        """
+        Apply new patterns here, then write them to the pattern file
+        
+        The other worker processes' watchers reload from the file within
+        one watch interval. Without a pattern file only this process changes.
+        
+        Returns:
+            dict: reload() summary plus the pattern file it was written to (or None)
+        
+        Raises:
+            OSError: If the file can't be written (this process keeps the new patterns)
+        """
+        summary = self.reload(keyword_patterns, ml_patterns)
+        summary["pattern_file"] = self.path
+        if self.path:
+            write_pattern_file(self.path, keyword_patterns, ml_patterns)
+            # Already applied here; the watcher shouldn't encode it again
+            self._file_state = self._stat()
+        return summary
+    
+    async def run(self, func, *args):
+        """
+        Await func(*args) (reload / publish / reload_from_file) on the reload thread
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(func, *args)
+        )
+    
+    def start(self):
+        """
+        Start watching the pattern file (no-op without a file or with interval 0)
+        """
+        if self.path and self.interval > 0 and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+            print(f"[*] Watching {self.path} for pattern changes every {self.interval:g}s")
+    
+    async def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            try:
+                await self._watcher
+            except asyncio.CancelledError:
+                pass
+            self._watcher = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+    
+    def stats(self):
+        return {
+            "pattern_set_version": self.detector.pattern_set_version(),
+            "pattern_file": self.path,
+            "watching": self._watcher is not None,
+            "reloads": self.reloads,
+            "last_reload": self.last_reload,
+            "last_error": self.last_error
+        }
+    
+    def _stat(self):
+        """
+        (mtime, size) of the pattern file, or None if it doesn't exist
+        """
+        try:
+            stat = os.stat(self.path) if self.path else None
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size) if stat else None
+    
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            state = self._stat()
+            if state is None or state == self._file_state:
+                continue
+            try:
+                await self.run(self.reload_from_file)
+            except Exception as e:
+                # Keep serving the old patterns; retry only after the next edit
+                self._file_state = state
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"[!] Pattern reload failed, keeping previous patterns: {self.last_error}")
@@ -0,0 +1,394 @@
+"""
+VeilGuard offline bulk scanner
+
+Runs hybrid detection (keyword + ML) over large local prompt files, for
+back-testing patterns and thresholds against an archive without going
+through the HTTP API:
+
+- The input is memory-mapped and cut into byte-range shards aligned on
+  line boundaries, so no process reads more than its own shard.
+- A pool of worker processes scans the shards. The torch model is loaded
+  once before forking and shared copy-on-write, like veilguard_workers.
+- Each shard writes its verdicts to its own part file, batch by batch,
+  and records a checkpoint (input offset + output size) after each batch.
+  Re-running the same command resumes every shard where it stopped.
+
+Inputs: JSONL (text in "user_input", "text" or "prompt", or a bare string),
+CSV/TSV with a header row (one record per line) and plain text (one prompt
+per line). Output: <output>/part-NNNNN.jsonl, one compact verdict per
+record with its byte offset, plus <output>/scan.json with the job manifest
+and totals. Parts are numbered in input order.
+
+Usage:
+    python -m veilguard scan prompts.jsonl --output scan-out/ --workers 8
+    python -m veilguard scan archive.csv --column prompt --id-column id --output scan-out/
+"""
+
+import argparse
+import contextlib
+import csv
+import gc
+import json
+import mmap
+import multiprocessing
+import os
+import sys
+import time
+
+# Shard size (VEILGUARD_SCAN_SHARD_MB) and records per detect_many() call
+DEFAULT_SHARD_MB = 64
+DEFAULT_BATCH_SIZE = 256
+
+MANIFEST_FILE = "scan.json"
+FORMATS = ("jsonl", "csv", "tsv", "text")
+CSV_TEXT_COLUMNS = ("user_input", "text", "prompt")
+
+def detect_format(path):
+    """
+    Input format from the file extension (jsonl, csv, tsv, else text)
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension in (".csv", ".tsv"):
+        return extension[1:]
+    return "text"
+
+def read_header(data, fmt, column=None, id_column=None):
+    """
+    Parse the CSV/TSV header row
+    
+    Returns:
+        tuple: (offset of the first record, text column index, id column index or None)
+    """
+    if fmt not in ("csv", "tsv"):
+        return 0, None, None
+    
+    end = data.find(b"\n")
+    end = len(data) if end < 0 else end
+    header = next(csv.reader([data[:end].decode("utf-8-sig").rstrip("\r")],
+                             delimiter="\t" if fmt == "tsv" else ","))
+    
+    if column is None:
+        column = next((name for name in CSV_TEXT_COLUMNS if name in header), None)
+    if column not in header:
+        raise ValueError(f"Text column {column!r} not in header {header}; pass --column")
+    if id_column is not None and id_column not in header:
+        raise ValueError(f"Id column {id_column!r} not in header {header}")
+    return end + 1, header.index(column), header.index(id_column) if id_column else None
+
+def plan_shards(data, start, shard_bytes):
+    """
+    Split data[start:] into (start, end) byte ranges of about shard_bytes,
+    each ending just after a newline (or at the end of the file)
+    """
+    shards = []
+    while start < len(data):
+        end = data.find(b"\n", min(start + shard_bytes, len(data)) - 1)
+        end = len(data) if end < 0 else end + 1
+        shards.append((start, end))
+        start = end
+    return shards
+
+def iter_records(data, start, end, fmt, text_index=None, id_index=None):
+    """
+    Records in data[start:end]
+    
+    Yields:
+        tuple: (byte offset, text, id, error); text is None for a bad record
+    """
+    from veilguard_stream import parse_record
+    
+    delimiter = "\t" if fmt == "tsv" else ","
+    offset = start
+    while offset < end:
+        newline = data.find(b"\n", offset, end)
+        line_end = end if newline < 0 else newline
+        line = data[offset:line_end]
+        record_offset, offset = offset, line_end + 1
+        
+        if not line.strip():
+            continue
+        try:
+            if fmt == "jsonl":
+                text, record_id, _ = parse_record(line)
+            elif fmt == "text":
+                text, record_id = line.decode("utf-8").rstrip("\r"), None
+            else:
+                row = next(csv.reader([line.decode("utf-8").rstrip("\r")], delimiter=delimiter))
+                text = row[text_index]
+                record_id = row[id_index] if id_index is not None else None
+        except (ValueError, IndexError) as e:
+            yield record_offset, None, None, f"{type(e).__name__}: {e}"
+            continue
+        yield record_offset, text, record_id, None
+
+def compact_verdict(offset, record_id, result):
+    """
+    The fields of a hybrid verdict that back-testing needs, one output row
+    """
+    return {
+        "offset": offset,
+        "id": record_id,
+        "blocked": result["blocked"],
+        "risk_level": result["risk_level"],
+        "detection_method": result["detection_method"],
+        "ml_similarity_score": result["ml_similarity_score"],
+        "patterns_found": result["patterns_found"]
+    }
+
+# ----------------------------------------------------------------------------
+# Checkpoints
+# ----------------------------------------------------------------------------
+
+def _part_paths(output_dir, index):
+    base = os.path.join(output_dir, f"part-{index:05d}")
+    return base + ".jsonl", base + ".ckpt"
+
+def _write_json(path, data):
+    """
+    Write JSON atomically (tmp file + os.replace), so a kill never leaves half a checkpoint
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+# ----------------------------------------------------------------------------
+# Worker processes
+# ----------------------------------------------------------------------------
+
+_detector = None
+
+def _init_worker(threads):
+    """
+    Build this worker's hybrid detector (the encoder itself is inherited from the parent)
+    """
+    global _detector
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    
+    from veilguard_hybrid import VeilGuardHybrid
+    
+    # One banner per worker would drown the progress lines
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        _detector = VeilGuardHybrid()
+
+def _scan_shard(job):
+    """
+    Scan one shard, resuming from its checkpoint
+    
+    Returns:
+        dict: The shard's final checkpoint (records, blocked, errors)
+    """
+    output_path, checkpoint_path = _part_paths(job["output_dir"], job["index"])
+    checkpoint = _read_json(checkpoint_path) or {
+        "offset": job["start"], "output_bytes": 0, "records": 0, "blocked": 0, "errors": 0, "done": False
+    }
+    if checkpoint["done"]:
+        return checkpoint
+    
+    with open(job["input"], "rb") as f, open(output_path, "ab") as output:
+        # Anything written after the last checkpoint is redone
+        output.truncate(checkpoint["output_bytes"])
+        output.seek(checkpoint["output_bytes"])
+        
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            records = iter_records(data, checkpoint["offset"], job["end"], job["format"],
+                                   job["text_index"], job["id_index"])
+            batch = []
+            for record in records:
+                batch.append(record)
+                if len(batch) >= job["batch_size"]:
+                    _flush_batch(batch, data, job, output, checkpoint, checkpoint_path)
+                    batch = []
+            if batch:
+                _flush_batch(batch, data, job, output, checkpoint, checkpoint_path)
+        finally:
+            data.close()
+    
+    checkpoint["offset"] = job["end"]
+    checkpoint["done"] = True
+    _write_json(checkpoint_path, checkpoint)
+    return checkpoint
+
+def _flush_batch(batch, data, job, output, checkpoint, checkpoint_path):
+    """
+    Detect one batch, append its verdicts and advance the checkpoint past it
+    """
+    texts = [text for _, text, _, error in batch if error is None]
+    results = iter(_detector.detect_many(texts) if texts else [])
+    
+    lines = []
+    for offset, _, record_id, error in batch:
+        if error is not None:
+            lines.append(json.dumps({"offset": offset, "error": error}))
+            checkpoint["errors"] += 1
+            continue
+        verdict = compact_verdict(offset, record_id, next(results))
+        lines.append(json.dumps(verdict))
+        checkpoint["records"] += 1
+        checkpoint["blocked"] += verdict["blocked"]
+    
+    output.write(("\n".join(lines) + "\n").encode())
+    output.flush()
+    
+    # Resume point: just past the last record of this batch
+    last_offset = batch[-1][0]
+    newline = data.find(b"\n", last_offset, job["end"])
+    checkpoint["offset"] = job["end"] if newline < 0 else newline + 1
+    checkpoint["output_bytes"] = output.tell()
+    _write_json(checkpoint_path, checkpoint)
+
+# ----------------------------------------------------------------------------
+# Job driver
+# ----------------------------------------------------------------------------
+
+def scan(input_path, output_dir, fmt=None, column=None, id_column=None, workers=None,
+         threads=1, shard_mb=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Scan a prompt file into output_dir, resuming an earlier run of the same job
+    
+    Args:
+        input_path (str): JSONL, CSV/TSV or text file
+        output_dir (str): Where part files, checkpoints and scan.json go
+        fmt (str): jsonl, csv, tsv or text (default: from the extension)
+        column (str): CSV text column (default: user_input, text or prompt)
+        id_column (str): CSV column copied to each verdict's "id"
+        workers (int): Worker processes (default: all cores)
+        threads (int): Torch threads per worker
+        shard_mb (float): Shard size (default VEILGUARD_SCAN_SHARD_MB or 64)
+        batch_size (int): Records per encoder batch (and per checkpoint)
+    
+    Returns:
+        dict: The job manifest, including totals and records_per_sec
+    """
+    from veilguard_models import get_backend, get_encoder, get_model_name
+    
+    fmt = fmt or detect_format(input_path)
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r} (expected one of {', '.join(FORMATS)})")
+    workers = max(1, int(workers or os.cpu_count() or 1))
+    shard_bytes = int(float(shard_mb or os.getenv('VEILGUARD_SCAN_SHARD_MB') or DEFAULT_SHARD_MB) * 1024 * 1024)
+    
+    stat = os.stat(input_path)
+    with open(input_path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        first_record, text_index, id_index = read_header(data, fmt, column, id_column)
+        shards = plan_shards(data, first_record, shard_bytes)
+        if stat.st_size:
+            data.close()
+    
+    job = {
+        "input": os.path.abspath(input_path),
+        "input_bytes": stat.st_size,
+        "input_mtime_ns": stat.st_mtime_ns,
+        "format": fmt,
+        "column": column,
+        "id_column": id_column,
+        "model_name": get_model_name(),
+        "backend": get_backend(),
+        "shards": shards
+    }
+    
+    # A resumed job must be the same job: same input, options and shard layout
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = _read_json(manifest_path)
+    if manifest is not None:
+        if {key: manifest.get(key) for key in job} != json.loads(json.dumps(job)):
+            raise ValueError(f"{output_dir} holds a different scan (input, options or model changed); "
+                             f"use a new --output directory")
+    else:
+        manifest = dict(job)
+    manifest["completed"] = False
+    _write_json(manifest_path, manifest)
+    
+    jobs = []
+    done = []
+    for index, (start, end) in enumerate(shards):
+        checkpoint = _read_json(_part_paths(output_dir, index)[1])
+        if checkpoint and checkpoint["done"]:
+            done.append(checkpoint)
+            continue
+        jobs.append({
+            "index": index, "start": start, "end": end, "input": job["input"], "output_dir": output_dir,
+            "format": fmt, "text_index": text_index, "id_index": id_index, "batch_size": batch_size
+        })
+    print(f"[*] {len(shards)} shard(s) of ~{shard_bytes / (1024 * 1024):g} MB, "
+          f"{len(done)} already done, {len(jobs)} to scan with {workers} worker(s)", file=sys.stderr)
+    
+    started = time.perf_counter()
+    scanned = 0
+    if jobs:
+        # Torch is loaded once and shared copy-on-write; onnxruntime sessions
+        # aren't fork-safe, so ONNX workers load their own after the fork
+        if get_backend() == "torch":
+            with contextlib.redirect_stdout(sys.stderr):
+                get_encoder()
+        gc.freeze()
+        
+        context = multiprocessing.get_context("fork")
+        with context.Pool(min(workers, len(jobs)), initializer=_init_worker, initargs=(threads,)) as pool:
+            for checkpoint in pool.imap_unordered(_scan_shard, jobs):
+                done.append(checkpoint)
+                scanned += checkpoint["records"]
+                elapsed = time.perf_counter() - started
+                print(f"[*] {len(done)}/{len(shards)} shards, {scanned} records this run, "
+                      f"{scanned / elapsed:.0f} records/sec", file=sys.stderr)
+    
+    seconds = time.perf_counter() - started
+    manifest.update({
+        "completed": True,
+        "records": sum(checkpoint["records"] for checkpoint in done),
+        "blocked": sum(checkpoint["blocked"] for checkpoint in done),
+        "errors": sum(checkpoint["errors"] for checkpoint in done),
+        "last_run_seconds": round(seconds, 2),
+        "last_run_records_per_sec": round(scanned / seconds, 1) if scanned and seconds > 0 else 0.0
+    })
+    _write_json(manifest_path, manifest)
+    return manifest
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m veilguard scan",
+                                     description="Scan a prompt file offline with VeilGuard hybrid detection")
+    parser.add_argument("input", help="JSONL, CSV/TSV (with header) or text file (one prompt per line)")
+    parser.add_argument("--output", "-o", required=True, help="Output directory (re-run with the same one to resume)")
+    parser.add_argument("--format", choices=FORMATS, help="Input format (default: from the file extension)")
+    parser.add_argument("--column", help="CSV/TSV text column (default: user_input, text or prompt)")
+    parser.add_argument("--id-column", help="CSV/TSV column copied into each verdict's id")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: all cores)")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads per worker")
+    parser.add_argument("--shard-mb", type=float, help="Shard size in MB (default: VEILGUARD_SCAN_SHARD_MB or 64)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Records per encoder batch / checkpoint")
+    args = parser.parse_args(argv)
+    
+    # The scanner is already a process pool: don't nest encoder worker pools in it
+    os.environ.pop('VEILGUARD_ENCODER_WORKERS', None)
+    
+    try:
+        manifest = scan(args.input, args.output, args.format, args.column, args.id_column,
+                        args.workers, args.threads, args.shard_mb, args.batch_size)
+    except (ValueError, OSError) as e:
+        print(f"[!] {e}", file=sys.stderr)
+        return 1
+    
+    print(f"[+] {manifest['records']} records ({manifest['blocked']} blocked, {manifest['errors']} errors); "
+          f"this run: {manifest['last_run_seconds']}s, {manifest['last_run_records_per_sec']} records/sec",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
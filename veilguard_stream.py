@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from collections import deque
+
+from veilguard_batching import InferenceExecutor, QueueFullError
+
+# Records per detect_many() call (VEILGUARD_STREAM_BATCH)
+DEFAULT_BATCH_SIZE = 64
+
+# Batches being detected while the next one is read (VEILGUARD_STREAM_IN_FLIGHT)
+DEFAULT_IN_FLIGHT = 2
+
+# Longer lines are answered with an error record instead of being buffered
+DEFAULT_MAX_LINE_BYTES = 1024 * 1024
+
+# Stream batches only start while the inference queue is less than this
+# full, keeping the rest for interactive requests; otherwise they wait,
+# backing off from the first to the last delay (seconds)
+STREAM_QUEUE_SHARE = 0.5
+BACKOFF_SECONDS = (0.005, 0.2)
+
+TEXT_FIELDS = ("user_input", "text", "prompt")
+
+def parse_record(line):
+    """
+    Parse one NDJSON input line
+    
+    Accepts {"user_input" | "text" | "prompt": ..., "id": ..., "source": ...}
+    or a bare JSON string.
+    
+    Returns:
+        tuple: (text, id, source)
+    
+    Raises:
+        ValueError: If the line is not JSON or has no text
+    """
+    record = json.loads(line)
+    if isinstance(record, str):
+        return record, None, None
+    if not isinstance(record, dict):
+        raise ValueError("Expected a JSON object or string")
+    
+    for field in TEXT_FIELDS:
+        if isinstance(record.get(field), str):
+            return record[field], record.get("id"), record.get("source")
+    raise ValueError(f"No text field ({', '.join(TEXT_FIELDS)})")
+
+async def iter_lines(chunks, max_line_bytes):
+    """
+    Split an async stream of byte chunks into lines
+    
+    Yields (line bytes, None), or (None, error) for a line longer than
+    max_line_bytes; the rest of such a line is skipped, never buffered.
+    """
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if skipping:
+                # Tail of an over-long line, already reported
+                skipping = False
+                continue
+            if len(line) > max_line_bytes:
+                yield None, f"Line longer than {max_line_bytes} bytes"
+                continue
+            yield line, None
+        
+        if len(buffer) > max_line_bytes:
+            if not skipping:
+                yield None, f"Line longer than {max_line_bytes} bytes"
+            skipping = True
+            buffer = b""
+    
+    if buffer.strip() and not skipping:
+        yield buffer, None
+
+async def iter_file(path, chunk_size=64 * 1024):
+    """
+    Async byte-chunk iterator over a file ("-" = stdin) for the CLI
+    """
+    stream = sys.stdin.buffer if path == "-" else open(path, "rb")
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        if stream is not sys.stdin.buffer:
+            stream.close()
+
+class NDJSONScanner:
+    """
+    VeilGuard NDJSON Scanner
+    Screens newline-delimited JSON records in pipelined micro-batches
+    
+    Records are parsed as they arrive and grouped into batches of
+    batch_size. Each batch is one detect_many() job (keyword layer + one
+    batched encoder pass) on the inference executor. Up to in_flight
+    batches are detected while the next one is being read and parsed,
+    and verdicts are yielded in input order as soon as their batch is done.
+    
+    Memory stays constant: at most in_flight + 1 batches and one partial
+    line are held, whatever the stream length.
+    
+    With a bucketer (LengthBucketer), each batch is split by token length
+    and its buckets are detected as separate jobs.
+    
+    Streams are bulk work: a batch only starts while the inference queue
+    is under STREAM_QUEUE_SHARE of its limit, and otherwise waits for room
+    (backing off) rather than being rejected or crowding out /check.
+    
+    Every input line produces one output line: the verdict plus "line"
+    (1-based), "id" and "source", or {"line", "error"} for a bad record or
+    a batch whose detection failed. The last output line is
+    {"summary": {...}} with records/sec.
+    """
+    
+    def __init__(self, detector, batch_size=None, in_flight=None, max_line_bytes=None, bucketer=None):
+        self.detector = detector
+        self.bucketer = bucketer
+        self.batch_size = max(1, int(
+            batch_size or os.getenv('VEILGUARD_STREAM_BATCH') or DEFAULT_BATCH_SIZE
+        ))
+        self.in_flight = max(1, int(
+            in_flight or os.getenv('VEILGUARD_STREAM_IN_FLIGHT') or DEFAULT_IN_FLIGHT
+        ))
+        self.max_line_bytes = int(max_line_bytes or DEFAULT_MAX_LINE_BYTES)
+    
+    async def scan(self, chunks, executor):
+        """
+        Screen an NDJSON byte stream, yielding one dict per input line
+        
+        Args:
+            chunks: Async iterator of byte chunks (request.stream(), iter_file())
+            executor (InferenceExecutor): Runs the detection batches
+        
+        Yields:
+            dict: Verdict or error per input line, then one {"summary": ...}
+        """
+        started = time.perf_counter()
+        counts = {"records": 0, "blocked": 0, "errors": 0}
+        pending = deque()
+        batch = []
+        line_number = 0
+        
+        try:
+            async for line, error in iter_lines(chunks, self.max_line_bytes):
+                line_number += 1
+                if error is None and not line.strip():
+                    continue
+                if error is None:
+                    try:
+                        text, record_id, source = parse_record(line)
+                    except ValueError as e:
+                        error = str(e)
+                # Bad records travel with their batch, so output order matches input order
+                if error is None:
+                    batch.append((line_number, text, record_id, source, None))
+                else:
+                    batch.append((line_number, None, None, None, error))
+                
+                if len(batch) >= self.batch_size:
+                    pending.append(self._submit(batch, executor))
+                    batch = []
+                    if len(pending) >= self.in_flight:
+                        for output in await pending.popleft():
+                            self._count(output, counts)
+                            yield output
+            
+            if batch:
+                pending.append(self._submit(batch, executor))
+            while pending:
+                for output in await pending.popleft():
+                    self._count(output, counts)
+                    yield output
+        finally:
+            # Client gone or the input stream failed: don't leave batches running
+            for task in pending:
+                task.cancel()
+        
+        seconds = time.perf_counter() - started
+        counts["seconds"] = round(seconds, 3)
+        counts["records_per_sec"] = round(counts["records"] / seconds, 1) if seconds > 0 else 0.0
+        yield {"summary": counts}
+    
+    async def scan_ndjson(self, chunks, executor):
+        """
+        Same as scan(), encoded as NDJSON bytes (for StreamingResponse)
+        """
+        async for output in self.scan(chunks, executor):
+            yield (json.dumps(output) + "\n").encode()
+    
+    def _submit(self, batch, executor):
+        """
+        Start detecting one batch; returns a task resolving to its output dicts
+        """
+        return asyncio.ensure_future(self._run_batch(batch, executor))
+    
+    async def _run_batch(self, batch, executor):
+        """
+        Detect one batch once the inference queue has room for it
+        
+        A failed batch becomes one {"line", "error"} record per line, so the
+        stream carries on and still ends with its summary.
+        """
+        delay, max_delay = BACKOFF_SECONDS
+        stream_limit = max(1, int(executor.max_queue_depth * STREAM_QUEUE_SHARE))
+        while True:
+            try:
+                if executor.pending >= stream_limit:
+                    raise QueueFullError(f"Inference queue has {executor.pending} pending")
+                if self.bucketer is not None:
+                    return await self.bucketer.run(
+                        executor, self._detect_batch, batch,
+                        texts=[text for _, text, _, _, _ in batch]
+                    )
+                return await executor.run(self._detect_batch, batch)
+            except QueueFullError:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, max_delay)
+            except Exception as e:
+                print(f"[!] Stream batch failed (lines {batch[0][0]}-{batch[-1][0]}): {e}")
+                return [
+                    {"line": line_number, "error": f"Detection failed: {e}"}
+                    for line_number, _, _, _, _ in batch
+                ]
+    
+    def _detect_batch(self, batch):
+        texts = [text for _, text, _, _, error in batch if error is None]
+        verdicts = iter(self.detector.detect_many(texts) if texts else [])
+        
+        outputs = []
+        for line_number, _, record_id, source, error in batch:
+            if error is not None:
+                outputs.append({"line": line_number, "error": error})
+                continue
+            output = {"line": line_number, "id": record_id, "source": source}
+            output.update(next(verdicts))
+            outputs.append(output)
+        return outputs
+    
+    def _count(self, output, counts):
+        if "error" in output:
+            counts["errors"] += 1
+        else:
+            counts["records"] += 1
+            counts["blocked"] += output["blocked"]
+
+async def scan_file(path, output, detector, batch_size=None, in_flight=None):
+    """
+    Screen an NDJSON file with the given detector, writing NDJSON verdicts
+    
+    Returns:
+        dict: The summary (records, blocked, errors, seconds, records_per_sec)
+    """
+    scanner = NDJSONScanner(detector, batch_size, in_flight)
+    executor = InferenceExecutor()
+    summary = None
+    try:
+        async for result in scanner.scan(iter_file(path), executor):
+            if "summary" in result:
+                summary = result["summary"]
+                continue
+            output.write(json.dumps(result) + "\n")
+    finally:
+        executor.shutdown()
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Screen an NDJSON file of prompts with VeilGuard")
+    parser.add_argument("input", help="NDJSON file, one record per line ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="Where to write NDJSON verdicts (default stdout)")
+    parser.add_argument("--batch-size", type=int, help="Records per encoder batch (default: VEILGUARD_STREAM_BATCH)")
+    parser.add_argument("--in-flight", type=int, help="Batches detected concurrently (default: VEILGUARD_STREAM_IN_FLIGHT)")
+    args = parser.parse_args()
+    
+    from veilguard_hybrid import VeilGuardHybrid
+    
+    # Model loading progress goes to stderr: stdout may be the verdict stream
+    with contextlib.redirect_stdout(sys.stderr):
+        hybrid = VeilGuardHybrid()
+    output_file = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        stats = asyncio.run(scan_file(args.input, output_file, hybrid, args.batch_size, args.in_flight))
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+    
+    print(f"[+] {stats['records']} records ({stats['blocked']} blocked, {stats['errors']} errors) "
+          f"in {stats['seconds']}s = {stats['records_per_sec']} records/sec", file=sys.stderr)
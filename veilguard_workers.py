@@ -0,0 +1,550 @@
+"""
+VeilGuard encoder worker pool / inference server
+
+Scales the semantic layer across cores without loading one model copy per
+core:
+
+- EncoderPool loads the encoder once, then forks N worker processes. The
+  forked workers share the read-only weights with the parent through
+  copy-on-write pages, so memory stays roughly flat as workers are added.
+- Workers write embeddings straight into a shared-memory buffer owned by
+  the caller. Only the texts and a tiny (status, rows) reply go through the
+  pipe, and the embedding matrix is never pickled.
+- The inference server (python -m veilguard_workers) puts one pool behind a
+  local Unix socket, so several uvicorn workers can share it. Each API
+  process uses a RemoteEncoder instead of loading the model itself.
+
+Usage:
+    python -m veilguard_workers --workers 4 --socket /tmp/veilguard-encoder.sock
+    VEILGUARD_ENCODER_SERVER=/tmp/veilguard-encoder.sock uvicorn app:app --workers 4
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+DEFAULT_SOCKET = "/tmp/veilguard-encoder.sock"
+DEFAULT_WORKER_THREADS = 1
+
+# Rows per job sent to a single worker, and rows per RemoteEncoder buffer
+DEFAULT_CHUNK_SIZE = 32
+DEFAULT_BUFFER_ROWS = 1024
+DEFAULT_CONNECTIONS = 4
+
+# Output buffers a worker keeps mapped; least recently used are closed first,
+# so buffers of disconnected clients (or outgrown scratch buffers) don't pile up
+MAX_ATTACHED_SEGMENTS = 64
+
+def authkey_path(address):
+    """
+    Where the inference server leaves its generated secret for clients
+    """
+    return f"{address}.key"
+
+def get_authkey(address):
+    """
+    Shared secret for the inference server socket
+    
+    VEILGUARD_ENCODER_AUTHKEY if set, otherwise the key the server
+    generated next to its socket (<socket>.key, readable by its user only).
+    The link exchanges pickled objects, so there is no built-in default.
+    
+    Raises:
+        RuntimeError: If neither is available
+    """
+    key = os.getenv('VEILGUARD_ENCODER_AUTHKEY')
+    if key:
+        return key.encode()
+    try:
+        with open(authkey_path(address), "rb") as key_file:
+            key = key_file.read().strip()
+    except OSError:
+        key = b""
+    if not key:
+        raise RuntimeError(
+            f"No authkey for the encoder server at {address}: set VEILGUARD_ENCODER_AUTHKEY "
+            f"or start the server as the same user (it writes {authkey_path(address)})"
+        )
+    return key
+
+def create_authkey(address):
+    """
+    Server side: VEILGUARD_ENCODER_AUTHKEY, or a random key written to <socket>.key with mode 0600
+    """
+    path = authkey_path(address)
+    if os.path.exists(path):
+        os.unlink(path)
+    key = os.getenv('VEILGUARD_ENCODER_AUTHKEY')
+    if key:
+        return key.encode()
+    
+    key = secrets.token_hex(32).encode()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as key_file:
+        key_file.write(key)
+    return key
+
+def _attach(name, external):
+    """
+    Attach to a shared-memory segment created by another process
+    
+    Python < 3.13 registers attached segments with the resource tracker,
+    which would unlink them when the server exits. Segments created by an
+    outside client (external) belong to that client, so undo that. The
+    pool's own segments share the parent's tracker and are left alone.
+    """
+    segment = SharedMemory(name=name)
+    if external:
+        try:
+            resource_tracker.unregister(segment._name, "shared_memory")
+        except Exception:
+            pass
+    return segment
+
+def _worker_main(conn, inherited, encoder, factory, threads):
+    """
+    Worker process loop: encode texts into the caller's shared buffer
+    
+    Messages are (texts, segment name, row offset, external); the reply is
+    ("ok", rows) or ("error", message). None stops the worker.
+    """
+    # Close the parent's ends of earlier workers' pipes, otherwise those
+    # workers never see EOF if the parent dies
+    for other in inherited:
+        other.close()
+    
+    if encoder is None:
+        # Backends that aren't fork-safe (onnxruntime) load after the fork
+        encoder = factory()
+    else:
+        import torch
+        torch.set_num_threads(threads)
+    
+    # name -> attached segment, least recently used first
+    segments = OrderedDict()
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if message is None:
+            break
+        
+        texts, name, offset, external = message
+        try:
+            embeddings = encoder.encode(texts)
+            segment = segments.get(name)
+            if segment is None:
+                segment = segments[name] = _attach(name, external)
+                while len(segments) > MAX_ATTACHED_SEGMENTS:
+                    segments.popitem(last=False)[1].close()
+            segments.move_to_end(name)
+            out = np.ndarray(
+                (offset + len(texts), encoder.dimension), dtype=np.float32, buffer=segment.buf
+            )
+            out[offset:] = embeddings
+            del out
+            conn.send(("ok", len(texts)))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+    
+    for segment in segments.values():
+        segment.close()
+
+class EncoderPool:
+    """
+    VeilGuard Encoder Pool
+    Fork-based pool of encoder processes sharing one copy of the weights
+    
+    Drop-in for TorchEncoder/OnnxEncoder: encode(texts) returns a float32
+    matrix. Batches are split into chunk_size jobs and spread over idle
+    workers, so a large batch (or several concurrent callers) uses every
+    core. Each worker runs torch with VEILGUARD_WORKER_THREADS threads
+    (default 1) so workers don't fight over cores.
+    
+    The torch model is loaded in the parent before forking, and the parent
+    never runs inference itself (torch/OpenMP thread pools don't survive a
+    fork). onnxruntime sessions aren't fork-safe, so ONNX workers each open
+    their own session after the fork; the int8 model is small enough that
+    this costs little.
+    """
+    
+    def __init__(self, model_name, backend=None, workers=None, threads=None, chunk_size=None):
+        from veilguard_encoders import DEFAULT_BACKEND, create_encoder
+        
+        self.model_name = model_name
+        self.backend = backend or os.getenv('VEILGUARD_ENCODER_BACKEND') or DEFAULT_BACKEND
+        self.workers = max(1, int(
+            workers or os.getenv('VEILGUARD_ENCODER_WORKERS') or os.cpu_count() or 1
+        ))
+        self.threads = max(1, int(
+            threads or os.getenv('VEILGUARD_WORKER_THREADS') or DEFAULT_WORKER_THREADS
+        ))
+        self.chunk_size = max(1, int(chunk_size or DEFAULT_CHUNK_SIZE))
+        
+        def factory():
+            return create_encoder(self.model_name, self.backend)
+        
+        if self.backend == "torch":
+            encoder = factory()
+            self.dimension = encoder.dimension
+            self.max_seq_length = encoder.max_seq_length
+        else:
+            # Read the dimension from a throwaway session, then drop it before forking
+            probe = factory()
+            self.dimension = probe.dimension
+            self.max_seq_length = probe.max_seq_length
+            del probe
+            encoder = None
+        
+        # Move everything loaded so far out of the GC's reach, so collections
+        # in the workers don't touch (and un-share) the parent's pages
+        gc.collect()
+        gc.freeze()
+        
+        # Start the resource tracker now so the workers share it rather than
+        # each starting their own (which would report our buffers as leaked)
+        resource_tracker.ensure_running()
+        
+        context = multiprocessing.get_context("fork")
+        self._conns = []
+        self._processes = []
+        for _ in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(
+                target=_worker_main,
+                args=(child_conn, list(self._conns) + [parent_conn], encoder, factory, self.threads),
+                daemon=True
+            )
+            process.start()
+            child_conn.close()
+            self._conns.append(parent_conn)
+            self._processes.append(process)
+        
+        # The parent keeps the weights only so the workers can share them
+        self._encoder = encoder
+        
+        self._idle = queue.Queue()
+        for index in range(self.workers):
+            self._idle.put(index)
+        
+        # Scratch buffers for in-process encode() calls, one per thread
+        self._local = threading.local()
+        self._scratch_segments = []
+        self._scratch_lock = threading.Lock()
+        self._closed = False
+    
+    def encode(self, texts):
+        """
+        Encode texts on the worker processes
+        
+        Returns:
+            np.ndarray: float32 matrix, one row per text
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        
+        segment = self._scratch(len(texts))
+        self.encode_into(texts, segment.name, external=False)
+        view = np.ndarray((len(texts), self.dimension), dtype=np.float32, buffer=segment.buf)
+        # The buffer is reused by this thread's next call, so hand out a copy
+        result = view.copy()
+        del view
+        return result
+    
+    def encode_into(self, texts, name, offset=0, external=True):
+        """
+        Encode texts into rows offset.. of the shared-memory segment `name`
+        
+        The segment must hold (offset + len(texts)) x dimension float32 values.
+        Chunks are dispatched to idle workers as they free up; a caller only
+        blocks on an idle worker when it has nothing in flight itself, so
+        concurrent callers can't deadlock each other.
+        
+        Args:
+            external (bool): The segment was created outside this process tree
+                             (e.g. by a RemoteEncoder client)
+        """
+        pending = {}
+        errors = []
+        
+        def collect(index):
+            status, detail = self._conns[index].recv()
+            pending.pop(index)
+            self._idle.put(index)
+            if status != "ok":
+                errors.append(detail)
+        
+        for start in range(0, len(texts), self.chunk_size):
+            chunk = texts[start:start + self.chunk_size]
+            try:
+                index = self._idle.get_nowait()
+            except queue.Empty:
+                if pending:
+                    collect(next(iter(pending)))
+                index = self._idle.get()
+            pending[index] = start
+            self._conns[index].send((chunk, name, offset + start, external))
+        
+        while pending:
+            collect(next(iter(pending)))
+        
+        if errors:
+            raise RuntimeError(f"Encoder worker failed: {errors[0]}")
+    
+    def close(self):
+        """
+        Stop the worker processes and free the scratch buffers
+        """
+        if self._closed:
+            return
+        self._closed = True
+        for conn in self._conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        with self._scratch_lock:
+            for segment in self._scratch_segments:
+                segment.close()
+                segment.unlink()
+            self._scratch_segments = []
+    
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "threads_per_worker": self.threads,
+            "idle": self._idle.qsize(),
+            "alive": sum(process.is_alive() for process in self._processes)
+        }
+    
+    def _scratch(self, rows):
+        """
+        This thread's shared output buffer, grown to fit `rows` rows
+        """
+        segment = getattr(self._local, "segment", None)
+        needed = rows * self.dimension * 4
+        if segment is None or segment.size < needed:
+            with self._scratch_lock:
+                if segment is not None:
+                    self._scratch_segments.remove(segment)
+                    segment.close()
+                    segment.unlink()
+                segment = SharedMemory(create=True, size=max(needed, DEFAULT_CHUNK_SIZE * self.dimension * 4))
+                self._scratch_segments.append(segment)
+            self._local.segment = segment
+        return segment
+
+class RemoteEncoder:
+    """
+    VeilGuard Remote Encoder
+    Client for an inference server started with `python -m veilguard_workers`
+    
+    Used by the model registry when VEILGUARD_ENCODER_SERVER is set, so the
+    API process never loads the model. Holds `connections` socket
+    connections (VEILGUARD_ENCODER_CONNECTIONS, default 4), each with its
+    own shared-memory buffer that the server's workers write into; match it
+    to VEILGUARD_INFERENCE_THREADS.
+    """
+    
+    def __init__(self, address, model_name, backend=None, connections=None,
+                 buffer_rows=DEFAULT_BUFFER_ROWS):
+        self.address = address
+        self.connections = max(1, int(
+            connections or os.getenv('VEILGUARD_ENCODER_CONNECTIONS') or DEFAULT_CONNECTIONS
+        ))
+        self.buffer_rows = buffer_rows
+        self._expected = (model_name, backend)
+        
+        self._idle = queue.Queue()
+        self._segments = []
+        for _ in range(self.connections):
+            conn = self._connect()
+            segment = SharedMemory(create=True, size=buffer_rows * self.dimension * 4)
+            self._segments.append(segment)
+            self._idle.put((conn, segment))
+    
+    def encode(self, texts):
+        """
+        Encode texts on the inference server
+        
+        Returns:
+            np.ndarray: float32 matrix, one row per text
+        """
+        texts = list(texts)
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        
+        conn, segment = self._idle.get()
+        view = None
+        try:
+            # A connection dropped by a server restart is redialled once
+            for attempt in range(2):
+                try:
+                    if conn is None:
+                        conn = self._connect()
+                        print(f"[*] Reconnected to encoder server at {self.address}")
+                    view = np.ndarray((self.buffer_rows, self.dimension), dtype=np.float32, buffer=segment.buf)
+                    for start in range(0, len(texts), self.buffer_rows):
+                        chunk = texts[start:start + self.buffer_rows]
+                        conn.send(("encode", chunk, segment.name))
+                        status, detail = conn.recv()
+                        if status != "ok":
+                            raise RuntimeError(f"Encoder server failed: {detail}")
+                        result[start:start + len(chunk)] = view[:len(chunk)]
+                    break
+                except (EOFError, OSError) as e:
+                    # Only healthy connections go back; the next call dials again
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                    if attempt:
+                        raise RuntimeError(f"Encoder server at {self.address} unreachable: {e}") from e
+        finally:
+            del view
+            self._idle.put((conn, segment))
+        
+        return result
+    
+    def close(self):
+        while not self._idle.empty():
+            conn, segment = self._idle.get_nowait()
+            if conn is not None:
+                conn.close()
+            segment.close()
+            segment.unlink()
+    
+    def _connect(self):
+        """
+        Dial the server and check it serves the expected model
+        """
+        model_name, backend = self._expected
+        conn = Client(self.address, family="AF_UNIX", authkey=get_authkey(self.address))
+        try:
+            conn.send(("hello",))
+            info = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            raise
+        
+        # The server decides the model; refuse to silently use a different one
+        if info["model_name"] != model_name or (backend and info["backend"] != backend):
+            conn.close()
+            raise RuntimeError(
+                f"Encoder server at {self.address} serves {info['model_name']} ({info['backend']}), "
+                f"expected {model_name} ({backend})"
+            )
+        if getattr(self, "dimension", info["dimension"]) != info["dimension"]:
+            conn.close()
+            raise RuntimeError(f"Encoder server at {self.address} changed dimension to {info['dimension']}")
+        self.model_name = info["model_name"]
+        self.backend = info["backend"]
+        self.dimension = info["dimension"]
+        self.max_seq_length = info["max_seq_length"]
+        return conn
+
+def _serve_client(conn, pool):
+    """
+    Handle one API-process connection until it disconnects
+    """
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                break
+            
+            if message[0] == "hello":
+                conn.send({
+                    "model_name": pool.model_name,
+                    "backend": pool.backend,
+                    "dimension": pool.dimension,
+                    "max_seq_length": pool.max_seq_length
+                })
+            elif message[0] == "encode":
+                _, texts, name = message
+                try:
+                    pool.encode_into(texts, name)
+                    conn.send(("ok", len(texts)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+    finally:
+        conn.close()
+
+def serve(model_name=None, backend=None, workers=None, address=None):
+    """
+    Run the inference server: one EncoderPool behind a local Unix socket
+    
+    Args:
+        model_name (str): Model to serve. Defaults to VEILGUARD_MODEL
+        backend (str): Encoder backend. Defaults to VEILGUARD_ENCODER_BACKEND
+        workers (int): Worker processes. Defaults to VEILGUARD_ENCODER_WORKERS or CPU count
+        address (str): Socket path. Defaults to VEILGUARD_ENCODER_SERVER or /tmp/veilguard-encoder.sock
+    """
+    from veilguard_models import get_model_name, get_backend, process_memory_mb
+    
+    address = address or os.getenv('VEILGUARD_ENCODER_SERVER') or DEFAULT_SOCKET
+    if os.path.exists(address):
+        os.unlink(address)
+    
+    print(f"[*] Starting encoder pool for '{get_model_name(model_name)}'...")
+    pool = EncoderPool(get_model_name(model_name), get_backend(backend), workers)
+    
+    # Treat SIGTERM like Ctrl+C so the workers and the socket get cleaned up
+    # (set after forking, so the workers keep the default handler)
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    
+    # Only this user may connect: the socket is created 0600 (no window
+    # with wider permissions), and so is the generated key file
+    authkey = create_authkey(address)
+    old_umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(old_umask)
+    os.chmod(address, 0o600)
+    print(f"[+] {pool.workers} encoder workers ready on {address} "
+          f"(server RSS {process_memory_mb()} MB)")
+    
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+                # Bad authkey or a client that hung up mid-handshake
+                print(f"[!] Rejected connection: {e}")
+                continue
+            threading.Thread(target=_serve_client, args=(conn, pool), daemon=True).start()
+    except KeyboardInterrupt:
+        print("\n[*] Shutting down encoder server...")
+    finally:
+        listener.close()
+        if os.path.exists(authkey_path(address)):
+            os.unlink(authkey_path(address))
+        pool.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VeilGuard encoder inference server")
+    parser.add_argument("--model", help="Model name or path (default: VEILGUARD_MODEL)")
+    parser.add_argument("--backend", help="torch, onnx or onnx-int8 (default: VEILGUARD_ENCODER_BACKEND)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: VEILGUARD_ENCODER_WORKERS or CPU count)")
+    parser.add_argument("--socket", help=f"Unix socket path (default: {DEFAULT_SOCKET})")
+    args = parser.parse_args()
+    
+    serve(args.model, args.backend, args.workers, args.socket)